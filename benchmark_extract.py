@@ -0,0 +1,99 @@
+"""Бенчмарк извлечения ссылок t.me/giftcode из больших зашумленных вставок.
+
+Сравнивает текущий однопроходный iter_links с прежней схемой
+(re.findall + re.search на каждое совпадение) и проверяет, что оба
+варианта находят одинаковый набор ссылок.
+
+Запуск:
+    python benchmark_extract.py --sizes 1 5 20 --duplicates 0.2
+"""
+import argparse
+import logging
+import random
+import re
+import string
+import time
+
+
+NOISE_WORDS = [
+    "подарок", "premium", "giveaway", "канал", "https://t.me/somechannel", "t.me/giftcodes",
+    "http://example.com/t.me", "@username", "✅", "🎁", "t.me/gift", "розыгрыш", "link:", "—",
+]
+
+
+def legacy_extract_links(text: str) -> list:
+    """Прежняя реализация LZTMarketBot.extract_links с последующей дедупликацией"""
+    links = re.findall(r'(?:https?://)?t\.me/giftcode/[a-zA-Z0-9_-]+', text)
+    normalized = []
+    for link in links:
+        match = re.search(r't\.me/giftcode/([a-zA-Z0-9_-]+)', link)
+        normalized.append(f"https://t.me/giftcode/{match.group(1)}" if match else link)
+    return list(dict.fromkeys(normalized))
+
+
+def random_code(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_letters + string.digits + "_-", k=rng.randint(12, 24)))
+
+
+def generate_paste(size_mb: float, duplicates: float, seed: int = 42) -> str:
+    """Текст заданного размера: шум, ссылки с https и без, часть ссылок повторяется"""
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    parts = []
+    codes = []
+    length = 0
+    while length < target:
+        if rng.random() < 0.3:
+            if codes and rng.random() < duplicates:
+                code = rng.choice(codes)
+            else:
+                code = random_code(rng)
+                codes.append(code)
+            prefix = rng.choice(["https://", "http://", ""])
+            chunk = f"{prefix}t.me/giftcode/{code}"
+        else:
+            chunk = " ".join(rng.choices(NOISE_WORDS, k=rng.randint(1, 6)))
+        chunk += rng.choice([" ", "\n", ", ", " | "])
+        parts.append(chunk)
+        length += len(chunk)
+    return "".join(parts)
+
+
+def measure(func, text: str, repeat: int) -> tuple:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(text)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк извлечения ссылок из вставок")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 5, 20], help="размер вставки, МБ")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="доля повторных ссылок")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов на замер (берется лучший)")
+    args = parser.parse_args()
+    
+    logging.getLogger("lzt_market_bot_multilang").setLevel(logging.WARNING)
+    from lzt_market_bot_multilang import iter_links
+    
+    header = f"{'size MB':>8} {'links':>8} {'legacy s':>9} {'engine s':>9} {'MB/s':>8} {'speedup':>8}"
+    print(header)
+    print("-" * len(header))
+    for size_mb in args.sizes:
+        text = generate_paste(size_mb, args.duplicates)
+        legacy_time, legacy_links = measure(legacy_extract_links, text, args.repeat)
+        engine_time, engine_links = measure(lambda value: list(iter_links(value)), text, args.repeat)
+        
+        if engine_links != legacy_links:
+            raise SystemExit(f"Расхождение результатов на {size_mb} МБ: "
+                             f"{len(engine_links)} против {len(legacy_links)}")
+        
+        print(f"{size_mb:>8.1f} {len(engine_links):>8} {legacy_time:>9.3f} {engine_time:>9.3f} "
+              f"{size_mb / engine_time:>8.1f} {legacy_time / engine_time:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Бенчмарк загрузки и удаления товаров на локальном моке LZT Market.
+
+Для каждого уровня параллельности поднимает свежий MockMarket, загружает
+набор ссылок через LZTMarketBot.upload_accounts_batch, затем удаляет их
+через delete_items_batch. Печатает items/sec, p50/p95/p99 задержки
+запросов и число повторов и ответов 429. Кроме основного прогона каждый
+уровень повторяется со случайными одиночными 429 (--sporadic-429), чтобы
+было видно, как rate limiter переносит редкие ограничения.
+
+Прогон с conc "auto" удаляет без фиксированной параллельности, как выдача
+в боте (AdaptiveConcurrencyLimiter); его колонка sec — время полной выдачи.
+
+Запуск:
+    python benchmark_upload.py --items 300 --concurrency 2 5 10 20 --latency 0.1 --rate-limit 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from mock_lzt_server import MockMarket
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class RequestStats:
+    """Замер задержек и статусов запросов бота через aiohttp.TraceConfig"""
+    
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_request_start.append(self._on_start)
+        self.trace_config.on_request_end.append(self._on_end)
+        self.trace_config.on_request_exception.append(self._on_exception)
+    
+    def reset(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+    
+    @property
+    def requests(self) -> int:
+        return sum(self.statuses.values()) + self.errors
+    
+    @property
+    def retries(self) -> int:
+        """Запросы, после которых бот планирует повтор: 429, 5xx и сетевые ошибки"""
+        return self.errors + sum(count for status, count in self.statuses.items() if status == 429 or status >= 500)
+    
+    async def _on_start(self, session, context, params):
+        context.started_at = time.perf_counter()
+    
+    async def _on_end(self, session, context, params):
+        self.latencies.append(time.perf_counter() - context.started_at)
+        self.statuses[params.response.status] = self.statuses.get(params.response.status, 0) + 1
+    
+    async def _on_exception(self, session, context, params):
+        self.errors += 1
+
+
+class BenchConfigManager:
+    """Минимальная замена ConfigManager: только то, что читает LZTMarketBot"""
+    
+    def __init__(self, config: dict):
+        self.config = config
+        self.settings_version = 0
+
+
+def load_bench_config(base_url: str, args) -> dict:
+    config_file = Path("bot_config.json")
+    config = json.loads(config_file.read_text(encoding="utf-8")) if config_file.exists() else {}
+    config["api_tokens"] = {"lzt_token": "benchmark", "user_id": "1"}
+    config.setdefault("http", {})["base_url"] = base_url
+    config["jobs"] = {"database": ":memory:"}
+    if args.initial_rate:
+        config.setdefault("rate_limit", {})["initial_rate"] = args.initial_rate
+    return config
+
+
+async def run_scenario(args, concurrency: int, scenario: str, rate_limit_prob: float) -> list:
+    """Загрузка и удаление; concurrency=None — адаптивное удаление, загрузка с максимальным уровнем"""
+    from lzt_market_bot_multilang import LZTMarketBot
+    
+    market = MockMarket(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                        rate_limit_prob=rate_limit_prob, duplicate_prob=args.duplicate_prob,
+                        retry_after=args.retry_after)
+    runner = web.AppRunner(market.create_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    
+    bot = LZTMarketBot(BenchConfigManager(load_bench_config(f"http://{host}:{port}", args)))
+    stats = RequestStats()
+    bot.trace_configs.append(stats.trace_config)
+    rows = []
+    
+    try:
+        links = [f"https://t.me/giftcode/bench{concurrency}x{i:06d}" for i in range(args.items)]
+        
+        stats.reset()
+        started = time.perf_counter()
+        results = await bot.upload_accounts_batch(links, 100, 90, concurrency=concurrency or max(args.concurrency))
+        elapsed = time.perf_counter() - started
+        uploaded = [result["data"]["item"]["item_id"] for result in results
+                    if result["success"] and result["data"].get("item", {}).get("item_id")]
+        rows.append(make_row(scenario, "upload", concurrency, len(links), len(uploaded), elapsed, stats))
+        
+        stats.reset()
+        started = time.perf_counter()
+        results = await bot.delete_items_batch(uploaded, concurrency=concurrency)
+        elapsed = time.perf_counter() - started
+        deleted = sum(1 for result in results if result["success"])
+        rows.append(make_row(scenario, "delete", concurrency, len(uploaded), deleted, elapsed, stats))
+    finally:
+        await bot.close()
+        bot.jobs.close()
+        await runner.cleanup()
+    
+    return rows
+
+
+def make_row(scenario: str, phase: str, concurrency: int, items: int, ok: int, elapsed: float,
+             stats: RequestStats) -> dict:
+    return {
+        "scenario": scenario,
+        "phase": phase,
+        "concurrency": "auto" if concurrency is None else concurrency,
+        "items": items,
+        "ok": ok,
+        "seconds": elapsed,
+        "items_per_sec": ok / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(stats.latencies, 0.50) * 1000,
+        "p95": percentile(stats.latencies, 0.95) * 1000,
+        "p99": percentile(stats.latencies, 0.99) * 1000,
+        "requests": stats.requests,
+        "retries": stats.retries,
+        "rate_limited": stats.statuses.get(429, 0),
+    }
+
+
+def print_rows(rows: list):
+    header = f"{'scenario':<10} {'phase':<7} {'conc':>4} {'items':>6} {'ok':>6} {'sec':>7} {'items/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'reqs':>6} {'retry':>6} {'429':>5}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['scenario']:<10} {row['phase']:<7} {row['concurrency']:>4} {row['items']:>6} {row['ok']:>6} {row['seconds']:>7.2f} {row['items_per_sec']:>8.2f} "
+              f"{row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f} {row['requests']:>6} {row['retries']:>6} {row['rate_limited']:>5}")
+
+
+async def run(args):
+    scenarios = [("base", args.rate_limit_prob)]
+    if args.sporadic_429:
+        scenarios.append((f"429 {args.sporadic_429:.0%}", args.sporadic_429))
+    
+    rows = []
+    for scenario, rate_limit_prob in scenarios:
+        for concurrency in [*args.concurrency, None]:
+            rows.extend(await run_scenario(args, concurrency, scenario, rate_limit_prob))
+    print_rows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк загрузки/удаления на моке LZT Market")
+    parser.add_argument("--items", type=int, default=200, help="ссылок на один прогон")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[2, 5, 10, 20])
+    parser.add_argument("--latency", type=float, default=0.1, help="средняя задержка мока, сек")
+    parser.add_argument("--jitter", type=float, default=0.05, help="разброс задержки мока, сек")
+    parser.add_argument("--rate-limit", type=float, default=20, help="лимит мока, запросов в секунду (0 — без лимита)")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0, help="вероятность случайного 429")
+    parser.add_argument("--sporadic-429", type=float, default=0.05,
+                        help="вероятность случайного 429 в дополнительном прогоне (0 — без него)")
+    parser.add_argument("--duplicate-prob", type=float, default=0.0, help="вероятность ошибки 'уже продается'")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After в ответах 429")
+    parser.add_argument("--initial-rate", type=float, default=0, help="стартовая скорость rate limiter бота")
+    args = parser.parse_args()
+    
+    logging.getLogger("lzt_market_bot_multilang").setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
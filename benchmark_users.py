@@ -0,0 +1,111 @@
+"""Бенчмарк хранилищ пользователей на большом числе записей.
+
+Сравнивает прежнюю схему (перезапись всего user_data.json на каждое
+изменение), JsonUserStore с отложенной записью и SqliteUserStore:
+перенос из JSON, точечные чтения языка и точечные записи.
+
+Запуск:
+    python benchmark_users.py --users 100000 --operations 5000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+from pathlib import Path
+
+
+LANGUAGES = ["ru", "en", "de", "kk", "uk", "zh", "ko"]
+
+
+def make_user_data(users: int) -> dict:
+    rng = random.Random(42)
+    return {"users": {str(1000000 + i): {"language": rng.choice(LANGUAGES)} for i in range(users)}}
+
+
+def legacy_set_language(path: Path, user_data: dict, user_id: str, language: str):
+    """Прежний ConfigManager.set_user_language: полная перезапись файла"""
+    user_data["users"].setdefault(user_id, {})["language"] = language
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(user_data, f, ensure_ascii=False, indent=4)
+
+
+def timed(rows: list, backend: str, operation: str, count: int, func):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    rows.append({"backend": backend, "operation": operation, "ops": count, "seconds": elapsed})
+
+
+async def run(args, workdir: Path) -> list:
+    from lzt_market_bot_multilang import JsonUserStore, SqliteUserStore
+    
+    rows = []
+    rng = random.Random(7)
+    json_path = workdir / "user_data.json"
+    user_data = make_user_data(args.users)
+    json_path.write_text(json.dumps(user_data, ensure_ascii=False, indent=4), encoding="utf-8")
+    user_ids = list(user_data["users"])
+    sample = [rng.choice(user_ids) for _ in range(args.operations)]
+    new_ids = [str(9000000 + i) for i in range(args.operations)]
+    
+    legacy_path = workdir / "legacy.json"
+    legacy_data = make_user_data(args.users)
+    legacy_ids = new_ids[:args.legacy_writes]
+    timed(rows, "legacy", "write", len(legacy_ids),
+          lambda: [legacy_set_language(legacy_path, legacy_data, user_id, "en") for user_id in legacy_ids])
+    
+    store_path = workdir / "store.json"
+    store_path.write_bytes(json_path.read_bytes())
+    store = JsonUserStore(store_path, debounce=0.05)
+    timed(rows, "json", "read", len(sample), lambda: [store.get_language(user_id) for user_id in sample])
+    started = time.perf_counter()
+    for user_id in new_ids:
+        store.set_language(user_id, "en")
+    await store.flush()
+    rows.append({"backend": "json", "operation": "write+flush", "ops": len(new_ids),
+                 "seconds": time.perf_counter() - started})
+    
+    sqlite_store = SqliteUserStore(str(workdir / "users.db"))
+    timed(rows, "sqlite", "migrate", args.users, lambda: sqlite_store.migrate_json(json_path))
+    timed(rows, "sqlite", "read", len(sample), lambda: [sqlite_store.get_language(user_id) for user_id in sample])
+    timed(rows, "sqlite", "has_user", len(sample), lambda: [sqlite_store.has_user(user_id) for user_id in sample])
+    timed(rows, "sqlite", "write", len(sample), lambda: [sqlite_store.set_language(user_id, "de") for user_id in sample])
+    timed(rows, "sqlite", "insert", len(new_ids),
+          lambda: [sqlite_store.set_language(user_id, "ko") for user_id in new_ids])
+    
+    if len(sqlite_store) != args.users + len(new_ids):
+        raise SystemExit(f"Неожиданное число пользователей в SQLite: {len(sqlite_store)}")
+    sqlite_store.close()
+    return rows
+
+
+def print_rows(rows: list, users: int):
+    print(f"Пользователей в базе: {users}")
+    header = f"{'backend':<8} {'operation':<12} {'ops':>7} {'total s':>9} {'ops/s':>11} {'us/op':>10}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        per_op = row["seconds"] / row["ops"] if row["ops"] else 0.0
+        ops_per_sec = row["ops"] / row["seconds"] if row["seconds"] > 0 else 0.0
+        print(f"{row['backend']:<8} {row['operation']:<12} {row['ops']:>7} {row['seconds']:>9.3f} "
+              f"{ops_per_sec:>11.0f} {per_op * 1e6:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилищ пользователей")
+    parser.add_argument("--users", type=int, default=100000, help="пользователей в базе")
+    parser.add_argument("--operations", type=int, default=5000, help="чтений/записей на замер")
+    parser.add_argument("--legacy-writes", type=int, default=20, help="записей с полной перезаписью файла")
+    args = parser.parse_args()
+    
+    logging.getLogger("lzt_market_bot_multilang").setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as workdir:
+        rows = asyncio.run(run(args, Path(workdir)))
+    print_rows(rows, args.users)
+
+
+if __name__ == "__main__":
+    main()
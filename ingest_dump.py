@@ -0,0 +1,105 @@
+"""Офлайн-разбор больших дампов с подарочными ссылками.
+
+Файл отображается в память (mmap), делится на части по границам строк и
+разбирается пулом процессов тем же регулярным выражением, что и
+LZTMarketBot.extract_links. Коды дедуплицируются с сохранением порядка и
+записываются по одной ссылке на строку — такой файл можно отправить боту
+документом. С --job-db ссылки сразу ставятся в очередь заданий загрузки,
+и бот подхватит задание при следующем запуске.
+
+Запуск:
+    python ingest_dump.py dump.txt -o links.txt --workers 8
+    python ingest_dump.py dump.txt --job-db upload_jobs.db --price 150 --duration 90 --chat-id 123 --user-id 123
+"""
+import argparse
+import logging
+import mmap
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def split_on_lines(mm, parts: int) -> list:
+    """Диапазоны (start, end), границы которых приходятся на конец строки"""
+    size = len(mm)
+    bounds = [0]
+    for part in range(1, parts):
+        newline = mm.find(b"\n", max(bounds[-1], size * part // parts))
+        if newline == -1:
+            break
+        bounds.append(newline + 1)
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def extract_range(path: str, pattern: bytes, start: int, end: int) -> list:
+    """Уникальные коды из диапазона файла в порядке появления (выполняется в дочернем процессе)"""
+    regex = re.compile(pattern)
+    codes = {}
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for match in regex.finditer(mm, start, end):
+            codes.setdefault(match.group(1), None)
+    return [code.decode("ascii") for code in codes]
+
+
+def ingest(path: str, pattern: bytes, workers: int) -> list:
+    """Дедуплицированный список кодов из всего файла"""
+    if os.path.getsize(path) == 0:
+        return []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        ranges = split_on_lines(mm, workers * 4)
+    
+    codes = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(extract_range, path, pattern, start, end) for start, end in ranges]
+        for future in futures:
+            for code in future.result():
+                codes.setdefault(code, None)
+    return list(codes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Параллельный разбор дампа подарочных ссылок")
+    parser.add_argument("dump", help="исходный файл")
+    parser.add_argument("-o", "--output", help="файл для списка ссылок (по одной на строку)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="число процессов")
+    parser.add_argument("--job-db", help="поставить ссылки в очередь заданий (файл upload_jobs.db)")
+    parser.add_argument("--price", type=int, help="цена для задания загрузки")
+    parser.add_argument("--duration", type=int, choices=[90, 180, 360], help="длительность в днях")
+    parser.add_argument("--chat-id", type=int, help="чат, куда бот пришлет отчет по заданию")
+    parser.add_argument("--user-id", help="пользователь Telegram (для языка отчета)")
+    args = parser.parse_args()
+    
+    if not args.output and not args.job_db:
+        parser.error("укажите --output и/или --job-db")
+    if args.job_db and None in (args.price, args.duration, args.chat_id):
+        parser.error("для --job-db нужны --price, --duration и --chat-id")
+    
+    logging.getLogger("lzt_market_bot_multilang").setLevel(logging.WARNING)
+    from lzt_market_bot_multilang import GIFTCODE_RE, GIFTCODE_URL, UploadJobStore
+    
+    started = time.perf_counter()
+    codes = ingest(args.dump, GIFTCODE_RE.pattern.encode("ascii"), max(1, args.workers))
+    elapsed = time.perf_counter() - started
+    size_mb = os.path.getsize(args.dump) / 1024 / 1024
+    print(f"{args.dump}: {size_mb:.1f} МБ, уникальных кодов: {len(codes)}, "
+          f"{elapsed:.2f} сек ({size_mb / elapsed if elapsed else 0:.1f} МБ/сек)")
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for code in codes:
+                f.write(f"{GIFTCODE_URL}{code}\n")
+        print(f"Ссылки записаны в {args.output}")
+    
+    if args.job_db:
+        jobs = UploadJobStore(args.job_db)
+        duration_text = f"{args.duration // 30} months"
+        job_id = jobs.create_job(args.user_id or str(args.chat_id), args.chat_id, args.price, args.duration,
+                                 duration_text, (GIFTCODE_URL + code for code in codes))
+        jobs.close()
+        print(f"Создано задание загрузки #{job_id}, бот выполнит его при следующем запуске")
+
+
+if __name__ == "__main__":
+    main()
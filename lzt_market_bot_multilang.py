@@ -1,11 +1,29 @@
-import requests
 import re
 import logging
 import asyncio
 import aiohttp
+import bisect
+import contextlib
+import csv
+import functools
+import heapq
+import itertools
 import json
+import os
+import random
+import stat
+import string
+import tempfile
+import uuid
+from collections import deque
+import sqlite3
+import time
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from aiohttp import web
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -32,6 +50,300 @@ logger = logging.getLogger(__name__)
  SELECT_DURATION, SELECT_COUNT, SELECT_UPLOAD_DURATION, SETTINGS_MENU,
  CHANGE_CURRENCY, CHANGE_ORIGIN) = range(11)
 
+# Имена состояний для меток метрик
+STATE_NAMES = {
+    LANGUAGE_SELECT: "language_select", MAIN_MENU: "main_menu", UPLOAD_LINKS: "upload_links",
+    UPLOAD_PRICE: "upload_price", CHECK_ITEMS: "check_items", SELECT_DURATION: "select_duration",
+    SELECT_COUNT: "select_count", SELECT_UPLOAD_DURATION: "select_upload_duration",
+    SETTINGS_MENU: "settings_menu", CHANGE_CURRENCY: "change_currency", CHANGE_ORIGIN: "change_origin",
+}
+
+# Лимит Bot API на скачивание файлов ботом
+MAX_DOCUMENT_SIZE = 20 * 1024 * 1024
+
+# Максимальная длина текста одного сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+# Кнопки длительности и соответствующие им сроки в днях
+DURATION_ACTIONS = {"3_months": 90, "6_months": 180, "12_months": 360}
+
+
+def write_file_atomic(path: Path, text):
+    """Запись через временный файл рядом с целевым и os.replace: при сбое остается старая версия.
+    
+    text — строка или итерируемое строк, которые пишутся по мере получения.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            if isinstance(text, str):
+                f.write(text)
+            else:
+                f.writelines(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp создает файл с правами 0600: права существующего файла сохраняются
+        with contextlib.suppress(FileNotFoundError):
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+class DebouncedJsonWriter:
+    """Отложенное сохранение JSON-файла.
+    
+    Все изменения за debounce секунд схлопываются в одну запись. get_data
+    возвращает ссылку на данные, которые владелец не правит на месте
+    (copy-on-write), поэтому сериализация и атомарная запись идут в пуле
+    потоков без копирования в event loop. Без запущенного event loop файл
+    пишется сразу.
+    """
+    
+    def __init__(self, path: Path, get_data, debounce: float = 1.0):
+        self.path = path
+        self.get_data = get_data
+        self.debounce = debounce
+        self._timer = None
+        self._writing = None
+        # mtime последней собственной записи: ее не нужно принимать за внешнюю правку
+        self.written_mtime = None
+    
+    def _serialize_and_write(self, data):
+        write_file_atomic(self.path, json.dumps(data, ensure_ascii=False, indent=4))
+        self.written_mtime = self.path.stat().st_mtime_ns
+    
+    def write_now(self):
+        """Синхронная запись текущего состояния"""
+        self._serialize_and_write(self.get_data())
+    
+    def schedule(self):
+        """Пометить данные измененными; запись произойдет по истечении окна"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.write_now()
+            return
+        if self._timer is None:
+            self._timer = loop.call_later(self.debounce, self._start_write, loop)
+    
+    def _start_write(self, loop):
+        self._timer = None
+        if self._writing is not None and not self._writing.done():
+            # Предыдущая запись еще идет — новая начнется после нее
+            self._timer = loop.call_later(self.debounce, self._start_write, loop)
+            return
+        self._writing = loop.run_in_executor(None, self._serialize_and_write, self.get_data())
+        self._writing.add_done_callback(self._on_written)
+    
+    def _on_written(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Не удалось сохранить {self.path}: {future.exception()!r}")
+    
+    async def flush(self):
+        """Немедленная запись отложенных изменений и ожидание текущей записи"""
+        pending = self._timer is not None
+        if pending:
+            self._timer.cancel()
+            self._timer = None
+        if self._writing is not None:
+            with contextlib.suppress(Exception):
+                await self._writing
+        if pending:
+            await asyncio.get_running_loop().run_in_executor(None, self._serialize_and_write, self.get_data())
+
+
+class JsonUserStore:
+    """Пользователи в user_data.json: файл целиком в памяти, запись отложенная.
+    
+    Отданный на запись снимок не меняется: первая правка после снимка
+    копирует словарь users (поверхностно), запись пользователя
+    заменяется новым словарем.
+    """
+    
+    def __init__(self, path: Path, debounce: float = 1.0):
+        self.path = path
+        self.data = self.load()
+        self.shared = False
+        self.writer = DebouncedJsonWriter(path, self.snapshot, debounce)
+    
+    def snapshot(self) -> dict:
+        self.shared = True
+        return self.data
+    
+    def load(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"users": {}}
+    
+    def __len__(self) -> int:
+        return len(self.data.get("users", {}))
+    
+    def has_user(self, user_id: str) -> bool:
+        return str(user_id) in self.data.get("users", {})
+    
+    def get_setting(self, user_id: str, key: str, default=None):
+        return self.data.get("users", {}).get(str(user_id), {}).get(key, default)
+    
+    def set_setting(self, user_id: str, key: str, value):
+        if self.shared:
+            self.data = {**self.data, "users": dict(self.data.get("users", {}))}
+            self.shared = False
+        users = self.data.setdefault("users", {})
+        users[str(user_id)] = {**users.get(str(user_id), {}), key: value}
+        self.writer.schedule()
+    
+    def get_language(self, user_id: str):
+        return self.get_setting(user_id, "language")
+    
+    def set_language(self, user_id: str, language: str):
+        self.set_setting(user_id, "language", language)
+    
+    async def flush(self):
+        await self.writer.flush()
+    
+    def close(self):
+        pass
+
+
+class SqliteUserStore:
+    """Пользователи в SQLite: чтение и запись одной строки по первичному ключу.
+    
+    Язык хранится отдельной колонкой, прочие настройки пользователя — JSON
+    в колонке settings. При первом запуске пустая база заполняется из
+    user_data.json; сам файл остается как резервная копия.
+    """
+    
+    def __init__(self, path: str = "users.db"):
+        self.path = Path(path)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                language TEXT,
+                settings TEXT NOT NULL DEFAULT '{}'
+            ) WITHOUT ROWID
+        """)
+        self.db.commit()
+    
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    
+    def migrate_json(self, json_path: Path) -> int:
+        """Импорт пользователей из user_data.json, если база еще пуста"""
+        if len(self) or not json_path.exists():
+            return 0
+        with open(json_path, 'r', encoding='utf-8') as f:
+            users = json.load(f).get("users", {})
+        rows = []
+        for user_id, user in users.items():
+            settings = {key: value for key, value in user.items() if key != "language"}
+            rows.append((str(user_id), user.get("language"), json.dumps(settings, ensure_ascii=False)))
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO users (user_id, language, settings) VALUES (?, ?, ?)", rows)
+        logger.info(f"Перенесено пользователей из {json_path} в {self.path}: {len(rows)}")
+        return len(rows)
+    
+    def has_user(self, user_id: str) -> bool:
+        return self.db.execute("SELECT 1 FROM users WHERE user_id = ?", (str(user_id),)).fetchone() is not None
+    
+    def get_language(self, user_id: str):
+        row = self.db.execute("SELECT language FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+        return row[0] if row else None
+    
+    def set_language(self, user_id: str, language: str):
+        with self.db:
+            self.db.execute(
+                "INSERT INTO users (user_id, language) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET language = excluded.language",
+                (str(user_id), language)
+            )
+    
+    def get_setting(self, user_id: str, key: str, default=None):
+        if key == "language":
+            language = self.get_language(user_id)
+            return default if language is None else language
+        row = self.db.execute("SELECT settings FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+        return json.loads(row[0]).get(key, default) if row else default
+    
+    def set_setting(self, user_id: str, key: str, value):
+        if key == "language":
+            self.set_language(user_id, value)
+            return
+        with self.db:
+            row = self.db.execute("SELECT settings FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+            settings = json.loads(row[0]) if row else {}
+            settings[key] = value
+            self.db.execute(
+                "INSERT INTO users (user_id, settings) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET settings = excluded.settings",
+                (str(user_id), json.dumps(settings, ensure_ascii=False))
+            )
+    
+    async def flush(self):
+        pass
+    
+    def close(self):
+        self.db.close()
+
+
+def create_user_store(settings: dict, json_path: Path, debounce: float = 1.0):
+    """Хранилище пользователей по секции users конфигурации: sqlite (по умолчанию) или json"""
+    if settings.get("backend", "sqlite") == "json":
+        return JsonUserStore(json_path, debounce)
+    store = SqliteUserStore(settings.get("database", "users.db"))
+    store.migrate_json(json_path)
+    return store
+
+
+class KeyboardCache:
+    """Готовые клавиатуры и обратный индекс "текст кнопки -> действие" по языкам.
+    
+    Строится один раз из переводов, поэтому ответ на нажатие кнопки — один
+    поиск в словаре и переиспользование готовой разметки. rebuild()
+    заменяет оба словаря целиком.
+    """
+    
+    LAYOUTS = {
+        "main": ("upload_accounts", "check_items", "issue_items", "settings", "cancel"),
+        "upload_duration": ("3_months", "6_months", "12_months", "back"),
+        "settings": ("change_currency", "change_origin", "back"),
+    }
+    
+    def __init__(self, translations: dict):
+        self.keyboards = {}
+        self.actions = {}
+        self.rebuild(translations)
+    
+    def rebuild(self, translations: dict):
+        fallback = translations.get("ru", {})
+        keyboards = {}
+        actions = {}
+        for lang, texts in translations.items():
+            def text_of(key):
+                return texts.get(key, fallback.get(key, key))
+            
+            keyboards[lang] = {
+                name: ReplyKeyboardMarkup([[text_of(key)] for key in layout], resize_keyboard=True)
+                for name, layout in self.LAYOUTS.items()
+            }
+            actions[lang] = {text_of(key): key for layout in self.LAYOUTS.values() for key in layout}
+        self.keyboards = keyboards
+        self.actions = actions
+    
+    def keyboard(self, lang: str, name: str) -> ReplyKeyboardMarkup:
+        return self.keyboards.get(lang, self.keyboards.get("ru", {}))[name]
+    
+    def action(self, lang: str, text: str):
+        """Ключ перевода нажатой кнопки или None, если текст не является кнопкой"""
+        return self.actions.get(lang, self.actions.get("ru", {})).get(text)
+
 
 class ConfigManager:
     """Менеджер конфигурации"""
@@ -40,13 +352,27 @@ class ConfigManager:
         self.config_file = Path('bot_config.json')
         self.translations_file = Path('translations.json')
         self.user_data_file = Path('user_data.json')
+        self.loaded_mtimes = {}
         self.config = self.load_config()
         self.translations = self.load_translations()
-        self.user_data = self.load_user_data()
+        self.keyboards = KeyboardCache(self.translations)
+        # Растет при каждом изменении настроек товара, сбрасывает кэш payload
+        self.settings_version = 0
+        
+        debounce = self.config.get("persistence", {}).get("debounce", 1.0)
+        self.users = create_user_store(self.config.get("users", {}), self.user_data_file, debounce)
+        self.config_writer = DebouncedJsonWriter(self.config_file, lambda: self.config, debounce)
+    
+    def file_mtime(self, path: Path):
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
     
     def load_config(self):
         """Загрузка конфигурации"""
         try:
+            self.loaded_mtimes[self.config_file] = self.file_mtime(self.config_file)
             with open(self.config_file, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except FileNotFoundError:
@@ -56,42 +382,105 @@ class ConfigManager:
     def load_translations(self):
         """Загрузка переводов"""
         try:
+            self.loaded_mtimes[self.translations_file] = self.file_mtime(self.translations_file)
             with open(self.translations_file, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except FileNotFoundError:
             logger.error(f"Translations file {self.translations_file} not found!")
             return {}
     
-    def load_user_data(self):
-        """Загрузка данных пользователей"""
-        try:
-            with open(self.user_data_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {"users": {}}
+    def save_config(self):
+        """Сохранение конфигурации (отложенное, см. DebouncedJsonWriter)"""
+        self.config_writer.schedule()
+    
+    async def flush(self):
+        """Запись всех отложенных изменений на диск"""
+        await self.users.flush()
+        await self.config_writer.flush()
+    
+    @staticmethod
+    def validate_config(config) -> str:
+        """Текст ошибки или None, если конфигурацию можно применять"""
+        if not isinstance(config, dict):
+            return "ожидался JSON-объект"
+        for section in ("api_tokens", "product_settings", "title_mapping", "available_currencies", "available_origins"):
+            if section in config and not isinstance(config[section], dict):
+                return f"секция {section} должна быть объектом"
+        return None
+    
+    @staticmethod
+    def validate_translations(translations) -> str:
+        """Текст ошибки или None, если переводы можно применять"""
+        if not isinstance(translations, dict) or not isinstance(translations.get("ru"), dict):
+            return "нет переводов для языка ru"
+        for lang, texts in translations.items():
+            if not isinstance(texts, dict) or not all(isinstance(text, str) for text in texts.values()):
+                return f"язык {lang}: ожидались строки"
+        return None
+    
+    def reload_changed(self) -> bool:
+        """Перечитать bot_config.json и translations.json, если их изменили снаружи.
+        
+        Новые данные проверяются и подменяют ссылки целиком: уже запущенные
+        задания держат прежний снимок (CompiledPayload), а новые запросы
+        видят новый. Невалидный файл не применяется.
+        """
+        reloaded = False
+        
+        mtime = self.file_mtime(self.config_file)
+        if mtime not in (self.loaded_mtimes.get(self.config_file), self.config_writer.written_mtime):
+            self.loaded_mtimes[self.config_file] = mtime
+            try:
+                config = json.loads(self.config_file.read_text(encoding='utf-8'))
+                error = self.validate_config(config)
+            except (OSError, ValueError) as e:
+                error = str(e)
+            if error:
+                logger.error(f"{self.config_file} не применен: {error}")
+            else:
+                self.config = config
+                self.settings_version += 1
+                reloaded = True
+                logger.info(f"{self.config_file} перезагружен")
+        
+        mtime = self.file_mtime(self.translations_file)
+        if mtime != self.loaded_mtimes.get(self.translations_file):
+            self.loaded_mtimes[self.translations_file] = mtime
+            try:
+                translations = json.loads(self.translations_file.read_text(encoding='utf-8'))
+                error = self.validate_translations(translations)
+            except (OSError, ValueError) as e:
+                error = str(e)
+            if error:
+                logger.error(f"{self.translations_file} не применен: {error}")
+            else:
+                self.keyboards.rebuild(translations)
+                self.translations = translations
+                reloaded = True
+                logger.info(f"{self.translations_file} перезагружен")
+        
+        return reloaded
     
-    def save_user_data(self):
-        """Сохранение данных пользователей"""
-        with open(self.user_data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.user_data, f, ensure_ascii=False, indent=4)
+    async def watch(self):
+        """Фоновая проверка файлов конфигурации по mtime"""
+        while True:
+            await asyncio.sleep(self.config.get("hot_reload", {}).get("interval", 2.0))
+            try:
+                self.reload_changed()
+            except Exception as e:
+                logger.error(f"Ошибка перезагрузки конфигурации: {e!r}")
     
-    def save_config(self):
-        """Сохранение конфигурации"""
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, ensure_ascii=False, indent=4)
+    def has_user(self, user_id: str) -> bool:
+        """Пользователь уже выбирал язык"""
+        return self.users.has_user(user_id)
     
     def get_user_language(self, user_id: str) -> str:
         """Получить язык пользователя"""
-        return self.user_data.get("users", {}).get(str(user_id), {}).get("language", "ru")
+        return self.users.get_language(user_id) or "ru"
     
     def set_user_language(self, user_id: str, language: str):
         """Установить язык пользователя"""
-        if "users" not in self.user_data:
-            self.user_data["users"] = {}
-        if str(user_id) not in self.user_data["users"]:
-            self.user_data["users"][str(user_id)] = {}
-        self.user_data["users"][str(user_id)]["language"] = language
-        self.save_user_data()
+        self.users.set_language(user_id, language)
     
     def get_translation(self, user_id: str, key: str, **kwargs) -> str:
         """Получить перевод для пользователя"""
@@ -99,15 +488,24 @@ class ConfigManager:
         text = self.translations.get(lang, {}).get(key, self.translations.get("ru", {}).get(key, key))
         return text.format(**kwargs) if kwargs else text
     
+    def get_keyboard(self, user_id: str, name: str) -> ReplyKeyboardMarkup:
+        """Готовая клавиатура из KeyboardCache на языке пользователя"""
+        return self.keyboards.keyboard(self.get_user_language(user_id), name)
+    
+    def get_action(self, user_id: str, text: str):
+        """Действие кнопки по ее тексту на языке пользователя"""
+        return self.keyboards.action(self.get_user_language(user_id), text)
+    
     def get_currency(self) -> str:
         """Получить текущую валюту"""
         return self.config.get("product_settings", {}).get("currency", "rub")
     
     def set_currency(self, currency: str):
         """Установить валюту"""
-        if "product_settings" not in self.config:
-            self.config["product_settings"] = {}
-        self.config["product_settings"]["currency"] = currency
+        # Новый снимок вместо правки на месте, как и при перезагрузке файла
+        product_settings = {**self.config.get("product_settings", {}), "currency": currency}
+        self.config = {**self.config, "product_settings": product_settings}
+        self.settings_version += 1
         self.save_config()
     
     def get_origin(self) -> str:
@@ -116,12 +514,1018 @@ class ConfigManager:
     
     def set_origin(self, origin: str):
         """Установить происхождение"""
-        if "product_settings" not in self.config:
-            self.config["product_settings"] = {}
-        self.config["product_settings"]["item_origin"] = origin
+        product_settings = {**self.config.get("product_settings", {}), "item_origin": origin}
+        self.config = {**self.config, "product_settings": product_settings}
+        self.settings_version += 1
         self.save_config()
 
 
+def parse_retry_after(value) -> float:
+    """Разбор заголовка Retry-After (секунды или HTTP-дата), None если заголовка нет"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(retry_at.timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+GIFTCODE_RE = re.compile(r't\.me/giftcode/([a-zA-Z0-9_-]+)')
+GIFTCODE_URL = "https://t.me/giftcode/"
+
+
+def iter_links(text: str, seen_codes: set = None):
+    """Ленивое извлечение нормализованных ссылок за один проход регулярки.
+    
+    Код подарка берется из группы совпадения, повторы отсеиваются на лету.
+    seen_codes можно передавать между вызовами при чтении текста частями.
+    """
+    if seen_codes is None:
+        seen_codes = set()
+    for match in GIFTCODE_RE.finditer(text):
+        code = match.group(1)
+        if code not in seen_codes:
+            seen_codes.add(code)
+            yield GIFTCODE_URL + code
+
+
+def giftcode_of(login: str) -> str:
+    """Код подарка из ссылки или из поля login товара"""
+    match = GIFTCODE_RE.search(login or "")
+    return match.group(1) if match else (login or "").strip()
+
+
+LINK_CHARS = frozenset(string.ascii_letters + string.digits + "_-./:")
+
+
+def iter_file_links(path, seen_codes: set = None, chunk_size: int = 65536):
+    """Потоковое извлечение ссылок из текстового файла частями по chunk_size символов"""
+    if seen_codes is None:
+        seen_codes = set()
+    carry = ""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            text = carry + chunk
+            # Хвост без разделителей может быть ссылкой, разорванной границей чанка
+            cut = len(text)
+            while cut > 0 and text[cut - 1] in LINK_CHARS:
+                cut -= 1
+            if cut == 0 and len(text) > chunk_size * 4:
+                # Файл без разделителей: не копим его в памяти целиком
+                cut = len(text)
+            yield from iter_links(text[:cut], seen_codes)
+            carry = text[cut:]
+    yield from iter_links(carry, seen_codes)
+
+
+class InventoryIndex:
+    """Снимок товаров продавца с индексом по коду подарка для проверки дубликатов за O(1)"""
+    
+    def __init__(self):
+        self.by_code = {}
+        self.by_item_id = {}
+        self.code_by_item_id = {}
+        # Один код может быть у нескольких товаров (старое объявление и повторная загрузка)
+        self.item_ids_by_code = {}
+        self.loaded_at = None
+    
+    def __contains__(self, login: str) -> bool:
+        return giftcode_of(login) in self.by_code
+    
+    def __len__(self) -> int:
+        return len(self.by_code)
+    
+    def age(self) -> float:
+        """Возраст последней полной загрузки в секундах (inf, если загрузки не было)"""
+        if self.loaded_at is None:
+            return float("inf")
+        return time.monotonic() - self.loaded_at
+    
+    def items(self) -> list:
+        """Товары снимка с известным item_id (их можно выдать и удалить)"""
+        return list(self.by_item_id.values())
+    
+    def replace(self, items: list):
+        """Полная замена индекса свежим списком товаров"""
+        self.by_code = {}
+        self.by_item_id = {}
+        self.code_by_item_id = {}
+        self.item_ids_by_code = {}
+        for item in items:
+            self.add(item)
+        self.loaded_at = time.monotonic()
+    
+    def add(self, item: dict):
+        """Добавление товара (после успешной загрузки или из полного списка)"""
+        if item.get("item_id") is not None:
+            self.by_item_id[item["item_id"]] = item
+        code = giftcode_of(item.get("login", ""))
+        if not code:
+            return
+        self.by_code[code] = item
+        if item.get("item_id") is not None:
+            self.code_by_item_id[item["item_id"]] = code
+            self.item_ids_by_code.setdefault(code, set()).add(item["item_id"])
+    
+    def remove(self, item_id):
+        """Удаление товара из индекса (после удаления с маркета)"""
+        self.by_item_id.pop(item_id, None)
+        code = self.code_by_item_id.pop(item_id, None)
+        if code is None:
+            return
+        item_ids = self.item_ids_by_code.get(code, set())
+        item_ids.discard(item_id)
+        if not item_ids:
+            self.item_ids_by_code.pop(code, None)
+        current = self.by_code.get(code)
+        if current is None or current.get("item_id") != item_id:
+            return
+        # Код остается занятым, пока на маркете есть другой товар с ним
+        if item_ids:
+            self.by_code[code] = self.by_item_id[next(iter(item_ids))]
+        else:
+            self.by_code.pop(code, None)
+
+
+class UploadJobStore:
+    """Очередь заданий загрузки в SQLite: состояние каждой ссылки переживает перезапуск бота"""
+    
+    PENDING = "pending"
+    IN_FLIGHT = "in_flight"
+    DONE = "done"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+    
+    # Значение jobs.finished для черновика: ссылки из файла записаны, цена еще не указана
+    DRAFT = -1
+    
+    def __init__(self, path: str = "upload_jobs.db"):
+        self.path = Path(path)
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                price INTEGER NOT NULL,
+                duration_days INTEGER NOT NULL,
+                duration_text TEXT NOT NULL,
+                finished INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_links (
+                job_id INTEGER NOT NULL REFERENCES jobs(job_id),
+                position INTEGER NOT NULL,
+                login TEXT NOT NULL,
+                state TEXT NOT NULL,
+                item_id INTEGER,
+                error TEXT,
+                PRIMARY KEY (job_id, position)
+            );
+            CREATE INDEX IF NOT EXISTS job_links_state ON job_links(job_id, state);
+        """)
+        self.db.commit()
+        # Черновики прошлого запуска принадлежали разговорам, которых больше нет
+        self._delete_drafts(self.db)
+    
+    def close(self):
+        self.db.close()
+    
+    def _delete_drafts(self, db, job_id: int = None):
+        condition, params = "finished = ?", (self.DRAFT,)
+        if job_id is not None:
+            condition, params = "finished = ? AND job_id = ?", (self.DRAFT, job_id)
+        with db:
+            db.execute(f"DELETE FROM job_links WHERE job_id IN (SELECT job_id FROM jobs WHERE {condition})", params)
+            db.execute(f"DELETE FROM jobs WHERE {condition}", params)
+    
+    def stage_links_file(self, user_id: str, chat_id: int, path, batch_size: int = 5000) -> tuple:
+        """Разбор файла и запись ссылок в черновик задания за один проход.
+        
+        Для запуска в executor: работает на собственном соединении и пишет
+        ссылки пачками по batch_size в отдельных транзакциях, чтобы не держать
+        блокировку записи. Возвращает (job_id, число ссылок); без ссылок
+        черновик удаляется и job_id равен None.
+        """
+        db = sqlite3.connect(self.path)
+        try:
+            with db:
+                job_id = db.execute(
+                    "INSERT INTO jobs (user_id, chat_id, price, duration_days, duration_text, finished, created_at) "
+                    "VALUES (?, ?, 0, 0, '', ?, ?)",
+                    (str(user_id), chat_id, self.DRAFT, time.time())
+                ).lastrowid
+            
+            count = 0
+            links = iter_file_links(path)
+            while True:
+                batch = list(itertools.islice(links, batch_size))
+                if not batch:
+                    break
+                with db:
+                    db.executemany(
+                        "INSERT INTO job_links (job_id, position, login, state) VALUES (?, ?, ?, ?)",
+                        ((job_id, position, link, self.PENDING)
+                         for position, link in enumerate(batch, start=count + 1))
+                    )
+                count += len(batch)
+            
+            if not count:
+                self._delete_drafts(db, job_id)
+                return None, 0
+            return job_id, count
+        finally:
+            db.close()
+    
+    def discard_draft(self, job_id: int):
+        """Удаление черновика задания на собственном соединении (для запуска в executor)"""
+        db = sqlite3.connect(self.path)
+        try:
+            self._delete_drafts(db, job_id)
+        finally:
+            db.close()
+    
+    def activate_draft(self, job_id: int, price: int, duration_days: int, duration_text: str) -> bool:
+        """Превращение черновика в задание с ценой и длительностью"""
+        with self.db:
+            cursor = self.db.execute(
+                "UPDATE jobs SET price = ?, duration_days = ?, duration_text = ?, finished = 0 "
+                "WHERE job_id = ? AND finished = ?",
+                (price, duration_days, duration_text, job_id, self.DRAFT)
+            )
+        return cursor.rowcount == 1
+    
+    def create_job(self, user_id: str, chat_id: int, price: int, duration_days: int,
+                   duration_text: str, links: list) -> int:
+        """Создание задания со всеми ссылками в состоянии pending"""
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO jobs (user_id, chat_id, price, duration_days, duration_text, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(user_id), chat_id, price, duration_days, duration_text, time.time())
+            )
+            job_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO job_links (job_id, position, login, state) VALUES (?, ?, ?, ?)",
+                ((job_id, position, link, self.PENDING) for position, link in enumerate(links, start=1))
+            )
+        return job_id
+    
+    def get_job(self, job_id: int):
+        return self.db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    
+    def unfinished_jobs(self) -> list:
+        """Задания, прерванные остановкой бота"""
+        return self.db.execute("SELECT * FROM jobs WHERE finished = 0 ORDER BY job_id").fetchall()
+    
+    def iter_unfinished_links(self, job_id: int, page_size: int = 500):
+        """Пары (позиция, ссылка), которые еще не выставлены и не пропущены.
+        
+        Читаются страницами, чтобы большое задание не поднималось в память целиком.
+        """
+        last_position = 0
+        while True:
+            rows = self.db.execute(
+                "SELECT position, login FROM job_links WHERE job_id = ? AND position > ? AND state IN (?, ?) "
+                "ORDER BY position LIMIT ?",
+                (job_id, last_position, self.PENDING, self.IN_FLIGHT, page_size)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row["position"], row["login"]
+            last_position = rows[-1]["position"]
+    
+    def in_flight_positions(self, job_id: int) -> set:
+        """Позиции ссылок, отправленных до остановки бота без сохраненного ответа"""
+        return {row[0] for row in self.db.execute(
+            "SELECT position FROM job_links WHERE job_id = ? AND state = ?", (job_id, self.IN_FLIGHT)
+        )}
+    
+    def count_unfinished(self, job_id: int) -> int:
+        return self.db.execute(
+            "SELECT COUNT(*) FROM job_links WHERE job_id = ? AND state IN (?, ?)",
+            (job_id, self.PENDING, self.IN_FLIGHT)
+        ).fetchone()[0]
+    
+    def count_failed(self, job_id: int) -> int:
+        return self.db.execute(
+            "SELECT COUNT(*) FROM job_links WHERE job_id = ? AND state = ?", (job_id, self.FAILED)
+        ).fetchone()[0]
+    
+    def mark(self, job_id: int, position: int, state: str, item_id=None, error: str = None):
+        with self.db:
+            self.db.execute(
+                "UPDATE job_links SET state = ?, item_id = ?, error = ? WHERE job_id = ? AND position = ?",
+                (state, item_id, error, job_id, position)
+            )
+    
+    def record_result(self, job_id: int, result: dict):
+        """Сохранение итогового результата загрузки одной ссылки"""
+        if result["success"]:
+            item_id = (result.get("data") or {}).get("item", {}).get("item_id")
+            self.mark(job_id, result["index"], self.DONE, item_id=item_id)
+        elif result.get("skip_error", False):
+            self.mark(job_id, result["index"], self.SKIPPED, error=result.get("error"))
+        else:
+            self.mark(job_id, result["index"], self.FAILED, error=result.get("error"))
+    
+    def requeue_failed(self, job_id: int) -> int:
+        """Возврат неудачных ссылок в очередь для повтора и повторное открытие задания"""
+        with self.db:
+            cursor = self.db.execute(
+                "UPDATE job_links SET state = ?, error = NULL WHERE job_id = ? AND state = ?",
+                (self.PENDING, job_id, self.FAILED)
+            )
+            self.db.execute("UPDATE jobs SET finished = 0 WHERE job_id = ?", (job_id,))
+        return cursor.rowcount
+    
+    def finish_job(self, job_id: int):
+        with self.db:
+            self.db.execute("UPDATE jobs SET finished = 1 WHERE job_id = ?", (job_id,))
+
+
+class ItemLeaseStore:
+    """Аренда товаров под выдачу в общей SQLite-базе.
+    
+    Выдача атомарно берет N свободных товаров нужной длительности; пока
+    аренда не истекла или не снята, другие выдачи этих товаров не видят.
+    Зависшие аренды (например, после падения бота) истекают через ttl;
+    живая выдача продлевает свою аренду через renew, пока идет удаление.
+    """
+    
+    def __init__(self, db: sqlite3.Connection, ttl: float = 600):
+        self.db = db
+        self.ttl = ttl
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS item_leases (
+                    item_id INTEGER PRIMARY KEY,
+                    lease_id TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self.db.execute("CREATE INDEX IF NOT EXISTS item_leases_lease ON item_leases(lease_id)")
+    
+    @staticmethod
+    def new_lease_id(user_id: str) -> str:
+        return f"{user_id}:{uuid.uuid4().hex}"
+    
+    def expire(self):
+        with self.db:
+            self.db.execute("DELETE FROM item_leases WHERE expires_at <= ?", (time.time(),))
+    
+    def leased_ids(self) -> set:
+        """item_id всех действующих аренд"""
+        self.expire()
+        return {row[0] for row in self.db.execute("SELECT item_id FROM item_leases")}
+    
+    def acquire(self, lease_id: str, items: list, count: int) -> list:
+        """Аренда до count товаров из items, которые никем не заняты.
+        
+        Выбор и запись идут в одной транзакции без await, поэтому две выдачи
+        не получат один и тот же товар.
+        """
+        if count <= 0:
+            raise ValueError(f"Число товаров для аренды должно быть положительным: {count}")
+        now = time.time()
+        with self.db:
+            self.db.execute("DELETE FROM item_leases WHERE expires_at <= ?", (now,))
+            leased = {row[0] for row in self.db.execute("SELECT item_id FROM item_leases")}
+            chosen = [item for item in items
+                      if item.get("item_id") is not None and item["item_id"] not in leased][:count]
+            self.db.executemany(
+                "INSERT INTO item_leases (item_id, lease_id, expires_at) VALUES (?, ?, ?)",
+                ((item["item_id"], lease_id, now + self.ttl) for item in chosen)
+            )
+        return chosen
+    
+    def renew(self, lease_id: str):
+        """Продление всех товаров аренды еще на ttl"""
+        with self.db:
+            self.db.execute("UPDATE item_leases SET expires_at = ? WHERE lease_id = ?",
+                            (time.time() + self.ttl, lease_id))
+    
+    async def keep_alive(self, lease_id: str):
+        """Продление аренды каждые ttl/3, пока задачу не отменят"""
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            self.renew(lease_id)
+    
+    def release(self, lease_id: str, item_ids: list = None):
+        """Снятие аренды со всех товаров выдачи или только с item_ids"""
+        with self.db:
+            if item_ids is None:
+                self.db.execute("DELETE FROM item_leases WHERE lease_id = ?", (lease_id,))
+            else:
+                self.db.executemany(
+                    "DELETE FROM item_leases WHERE lease_id = ? AND item_id = ?",
+                    ((lease_id, item_id) for item_id in item_ids)
+                )
+
+
+# Границы гистограмм задержек, сек
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HANDLER_BUCKETS = LATENCY_BUCKETS + (60.0, 300.0, 900.0)
+
+
+def format_labels(names, values, extra: tuple = ()) -> str:
+    """Метки в текстовом формате Prometheus: {name="value",...}"""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Монотонный счетчик Prometheus с метками"""
+    
+    kind = "counter"
+    
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.label_names = labels
+        self.values = {}
+    
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+    
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, format_labels(self.label_names, key), value
+
+
+class Gauge(Counter):
+    """Текущее значение (глубина очереди, число запросов в полете)"""
+    
+    kind = "gauge"
+    
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+    
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Counter):
+    """Гистограмма Prometheus: накопительные бакеты, сумма и количество"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series["buckets"][index] += 1
+        series["sum"] += value
+        series["count"] += 1
+    
+    def samples(self):
+        for key, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["buckets"]):
+                cumulative += count
+                yield f"{self.name}_bucket", format_labels(self.label_names, key, (("le", repr(bound)),)), cumulative
+            yield f"{self.name}_bucket", format_labels(self.label_names, key, (("le", "+Inf"),)), series["count"]
+            yield f"{self.name}_sum", format_labels(self.label_names, key), series["sum"]
+            yield f"{self.name}_count", format_labels(self.label_names, key), series["count"]
+
+
+class MetricsRegistry:
+    """Набор метрик процесса и HTTP-эндпоинт /metrics в формате Prometheus"""
+    
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+    
+    def __init__(self):
+        self.metrics = []
+    
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                # repr сохраняет все значащие цифры: :g обрезал бы счетчики после 1e6
+                lines.append(f"{name}{labels} {value!r}")
+        return "\n".join(lines) + "\n"
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.render().encode("utf-8"), headers={"Content-Type": self.content_type})
+    
+    async def start_server(self, settings: dict):
+        """Запуск локального HTTP-сервера метрик по секции metrics конфигурации; None, если выключен"""
+        if not settings.get("enabled", True):
+            return None
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        host = settings.get("host", "127.0.0.1")
+        port = settings.get("port", 9108)
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError as e:
+            logger.error(f"Не удалось запустить эндпоинт метрик на {host}:{port}: {e}")
+            await runner.cleanup()
+            return None
+        logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+        return runner
+
+
+metrics = MetricsRegistry()
+API_REQUESTS = metrics.register(Counter(
+    "lzt_api_requests_total", "Запросы к LZT Market API по эндпоинту и статусу", ("endpoint", "status")))
+API_LATENCY = metrics.register(Histogram(
+    "lzt_api_request_duration_seconds", "Время ответа LZT Market API без ожидания в rate limiter",
+    ("endpoint", "status")))
+API_RATE_LIMITED = metrics.register(Counter(
+    "lzt_api_rate_limited_total", "Ответы 429 от LZT Market API", ("endpoint",)))
+API_IN_FLIGHT = metrics.register(Gauge(
+    "lzt_api_requests_in_flight", "Запросы к LZT Market API, ожидающие ответа"))
+WORKER_RETRIES = metrics.register(Counter(
+    "worker_retries_total", "Повторы, поставленные в отложенную очередь", ("pool",)))
+WORKER_QUEUE_DEPTH = metrics.register(Gauge(
+    "worker_queue_depth", "Элементы, ожидающие воркера, включая отложенные повторы", ("pool",)))
+HANDLER_LATENCY = metrics.register(Histogram(
+    "telegram_handler_duration_seconds", "Длительность обработчиков по состоянию разговора",
+    ("state", "handler", "outcome"), buckets=HANDLER_BUCKETS))
+TELEGRAM_API_LATENCY = metrics.register(Histogram(
+    "telegram_api_request_duration_seconds",
+    "Время запросов к Bot API по методу: ответы обработчиков, очередь отправки, правки прогресса",
+    ("method", "outcome")))
+
+
+def api_endpoint(method: str, path: str) -> str:
+    """Имя эндпоинта для меток: fast-sell, user/items, delete"""
+    path = path.split("?", 1)[0]
+    if re.fullmatch(r"/\d+", path):
+        return "delete" if method.upper() == "DELETE" else "item"
+    if path == "/item/fast-sell":
+        return "fast-sell"
+    return re.sub(r"/\d+", "/:id", path).lstrip("/")
+
+
+class RetryScheduler:
+    """Отложенные повторы запросов: очередь по времени готовности с jitter.
+    
+    Повтор ждет своего времени в куче, не занимая слот воркера, а случайная
+    задержка не дает неудачным запросам повторяться синхронно.
+    """
+    
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.heap = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+    
+    @classmethod
+    def from_config(cls, settings: dict) -> "RetryScheduler":
+        """Создание планировщика из секции retry конфигурации"""
+        return cls(base_delay=settings.get("base_delay", 1.0), max_delay=settings.get("max_delay", 30.0))
+    
+    def __len__(self) -> int:
+        return len(self.heap)
+    
+    def backoff(self, attempt: int) -> float:
+        """Экспоненциальная задержка с полным jitter для номера попытки"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+    
+    def schedule(self, entry, delay: float):
+        heapq.heappush(self.heap, (time.monotonic() + delay, next(self._counter), entry))
+        self._wakeup.set()
+    
+    async def run(self, sink):
+        """Передача созревших повторов в sink(entry) в порядке готовности"""
+        while True:
+            self._wakeup.clear()
+            if not self.heap:
+                await self._wakeup.wait()
+                continue
+            delay = self.heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, entry = heapq.heappop(self.heap)
+            await sink(entry)
+
+
+async def run_worker_pool(items, handler, concurrency: int, max_attempts: int = 1,
+                          retry_scheduler: RetryScheduler = None, on_result=None, name: str = "worker",
+                          collect: bool = True) -> list:
+    """Обработка элементов пулом из N воркеров без барьеров между пачками.
+    
+    Следующий элемент берется в работу сразу, как только освобождается любой
+    слот. handler(item, position, attempt) вызывается с порядковым номером
+    от 1; результат с "retry": True уходит в отложенную очередь повторов,
+    пока не исчерпано max_attempts. on_result(position, result) получает
+    итоговые результаты по мере готовности, весь список возвращается в
+    исходном порядке. С collect=False результаты не копятся и возвращается
+    None: для больших заданий итоги собирает сам on_result. name — метка
+    пула в метриках.
+    """
+    concurrency = max(1, concurrency)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    scheduler = retry_scheduler if retry_scheduler is not None else RetryScheduler()
+    results = {}
+    unsettled = 0
+    produced = False
+    finished = asyncio.Event()
+    queued = 0
+    
+    def track(delta: int):
+        nonlocal queued
+        queued += delta
+        WORKER_QUEUE_DEPTH.inc(delta, pool=name)
+    
+    async def producer():
+        nonlocal unsettled, produced
+        for position, item in enumerate(items, start=1):
+            unsettled += 1
+            await queue.put((position, item, 0))
+            track(1)
+        produced = True
+        if not unsettled:
+            finished.set()
+    
+    async def worker():
+        nonlocal unsettled
+        while True:
+            position, item, attempt = await queue.get()
+            track(-1)
+            result = await handler(item, position, attempt)
+            if result.get("retry") and attempt + 1 < max_attempts:
+                delay = max(scheduler.backoff(attempt + 1), result.get("retry_after") or 0)
+                logger.info(f"Элемент {position}: попытка {attempt + 2}/{max_attempts} через {delay:.1f}с")
+                WORKER_RETRIES.inc(pool=name)
+                track(1)
+                scheduler.schedule((position, item, attempt + 1), delay)
+                continue
+            if collect:
+                results[position] = result
+            if on_result is not None:
+                on_result(position, result)
+            unsettled -= 1
+            if produced and not unsettled:
+                finished.set()
+    
+    tasks = [asyncio.create_task(producer()), asyncio.create_task(scheduler.run(queue.put))]
+    tasks += [asyncio.create_task(worker()) for _ in range(concurrency)]
+    waiter = asyncio.create_task(finished.wait())
+    try:
+        pending = {waiter, *tasks}
+        while not waiter.done():
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not waiter and task.exception() is not None:
+                    raise task.exception()
+    finally:
+        for task in tasks + [waiter]:
+            task.cancel()
+        await asyncio.gather(*tasks, waiter, return_exceptions=True)
+        track(-queued)
+    
+    if not collect:
+        return None
+    return [results[position] for position in sorted(results)]
+
+
+class AdaptiveRateLimiter:
+    """Адаптивный token bucket для запросов к API.
+    
+    Скорость растет аддитивно на increase_per_second за каждую секунду
+    трафика без 429 и уменьшается мультипликативно при перегрузке.
+    Retry-After блокирует выдачу токенов ровно на указанное сервером время;
+    одиночный 429 с Retry-After только ставит паузу, а скорость снижается,
+    когда за window секунд набирается repeats ответов 429 (или сервер не
+    сообщил, сколько ждать).
+    """
+    
+    def __init__(self, rate: float = 2.5, burst: int = 5, min_rate: float = 0.2,
+                 max_rate: float = 20.0, increase_per_second: float = 0.5, decrease_factor: float = 0.5,
+                 window: float = 5.0, repeats: int = 3):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_per_second = increase_per_second
+        self.decrease_factor = decrease_factor
+        self.window = window
+        self.repeats = repeats
+        
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.last_increase = None
+        self.rate_limited_at = deque()
+        self._lock = asyncio.Lock()
+    
+    @classmethod
+    def from_config(cls, settings: dict) -> "AdaptiveRateLimiter":
+        """Создание лимитера из секции rate_limit конфигурации"""
+        return cls(
+            rate=settings.get("initial_rate", 2.5),
+            burst=settings.get("burst", 5),
+            min_rate=settings.get("min_rate", 0.2),
+            max_rate=settings.get("max_rate", 20.0),
+            increase_per_second=settings.get("increase_per_second", 0.5),
+            decrease_factor=settings.get("decrease_factor", 0.5),
+            window=settings.get("window", 5.0),
+            repeats=settings.get("repeats", 3),
+        )
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    async def acquire(self):
+        """Ожидание токена перед запросом"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def on_success(self):
+        """API принял запрос без ограничения — ускоряемся пропорционально времени без 429"""
+        now = time.monotonic()
+        if self.last_increase is not None:
+            # Простой между заданиями не считается чистым трафиком: не больше секунды за ответ
+            clean = min(now - self.last_increase, 1.0)
+            self.rate = min(self.max_rate, self.rate + self.increase_per_second * clean)
+        self.last_increase = now
+    
+    def on_rate_limited(self, retry_after: float = None):
+        """API вернул 429 — выдерживаем Retry-After, при повторных 429 замедляемся"""
+        now = time.monotonic()
+        self.last_increase = None
+        self.rate_limited_at.append(now)
+        while self.rate_limited_at and now - self.rate_limited_at[0] > self.window:
+            self.rate_limited_at.popleft()
+        
+        congested = retry_after is None or len(self.rate_limited_at) >= self.repeats
+        # Одновременные 429 от запросов одной волны снижают скорость только один раз
+        if congested and now - self.last_decrease >= 1 / self.rate:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.last_decrease = now
+            logger.warning(f"Лимит API: скорость снижена до {self.rate:.2f} запр/сек")
+        
+        pause = retry_after if retry_after is not None else 1 / self.rate
+        self.blocked_until = max(self.blocked_until, now + pause)
+        # Ровно к концу паузы накопится один токен
+        self.tokens = 0.0
+        self.updated_at = max(self.updated_at, self.blocked_until - 1 / self.rate)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Число одновременных запросов, подстраиваемое по схеме AIMD, как окно перегрузки TCP.
+    
+    До первого признака перегрузки лимит растет на 1 с каждым успешным
+    ответом (slow start), затем на increase_step за каждые limit ответов.
+    429, ошибка сервера или задержка выше latency_factor от сглаженной
+    (srtt, как в TCP) уменьшают лимит в decrease_factor раз, но не чаще
+    раза за время одного запроса.
+    """
+    
+    def __init__(self, initial: int = 3, min_limit: int = 1, max_limit: int = 20,
+                 increase_step: float = 1.0, decrease_factor: float = 0.5, latency_factor: float = 2.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        
+        self.in_flight = 0
+        self.peak = int(self.limit)
+        self.srtt = None
+        self.slow_start = True
+        self.last_decrease = 0.0
+        self._released = asyncio.Event()
+    
+    @classmethod
+    def from_config(cls, settings: dict) -> "AdaptiveConcurrencyLimiter":
+        """Создание лимитера из секции delete_concurrency конфигурации"""
+        return cls(
+            initial=settings.get("initial", 3),
+            min_limit=settings.get("min", 1),
+            max_limit=settings.get("max", 20),
+            increase_step=settings.get("increase_step", 1.0),
+            decrease_factor=settings.get("decrease_factor", 0.5),
+            latency_factor=settings.get("latency_factor", 2.0),
+        )
+    
+    async def acquire(self):
+        """Ожидание свободного слота в пределах текущего лимита"""
+        while self.in_flight >= int(self.limit):
+            self._released.clear()
+            await self._released.wait()
+        self.in_flight += 1
+    
+    def release(self, latency: float, congested: bool):
+        """Освобождение слота с отчетом о задержке и признаке перегрузки"""
+        self.in_flight -= 1
+        now = time.monotonic()
+        slow = self.srtt is not None and latency > self.latency_factor * self.srtt
+        if not congested:
+            self.srtt = latency if self.srtt is None else 0.875 * self.srtt + 0.125 * latency
+        
+        if congested or slow:
+            if now - self.last_decrease >= latency:
+                previous = int(self.limit)
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self.slow_start = False
+                self.last_decrease = now
+                if int(self.limit) < previous:
+                    logger.info(f"Параллельность удаления снижена до {int(self.limit)}")
+        elif self.slow_start:
+            self.limit = min(self.max_limit, self.limit + 1)
+        else:
+            self.limit = min(self.max_limit, self.limit + self.increase_step / self.limit)
+        
+        self.peak = max(self.peak, int(self.limit))
+        self._released.set()
+
+
+class CompiledPayload:
+    """Предсобранное тело запроса fast-sell для одного набора настроек.
+    
+    Постоянная часть (заголовки, описание, extra) сериализуется один раз,
+    на каждую ссылку подставляются только login и price. Объект неизменяем
+    и служит снимком настроек для всего задания загрузки.
+    """
+    
+    __slots__ = ("duration_days", "currency", "item_origin", "_head")
+    
+    def __init__(self, template: dict, duration_days: int):
+        constant = {key: value for key, value in template.items() if key not in ("login", "price")}
+        body = json.dumps(constant, ensure_ascii=False)
+        object.__setattr__(self, "duration_days", duration_days)
+        object.__setattr__(self, "currency", template.get("currency"))
+        object.__setattr__(self, "item_origin", template.get("item_origin"))
+        object.__setattr__(self, "_head", body[:-1] + ', "price": ')
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledPayload неизменяем")
+    
+    def render(self, login: str, price: int) -> bytes:
+        """Готовое тело запроса для одной ссылки"""
+        return f'{self._head}{int(price)}, "login": {json.dumps(login, ensure_ascii=False)}}}'.encode("utf-8")
+
+
+class CircuitOpenError(aiohttp.ClientError):
+    """API недоступно дольше допустимого — запрос отклонен без обращения к серверу"""
+
+
+class CircuitBreaker:
+    """Автомат защиты для запросов к LZT Market API.
+    
+    closed: запросы идут, ведется статистика ошибок и таймаутов в окне.
+    open: доля ошибок превысила порог — новые запросы паркуются и ждут.
+    half_open: после паузы пропускается один пробный запрос; успех
+    закрывает автомат и отпускает всех ожидающих, ошибка открывает снова.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_ratio: float = 0.5, min_requests: int = 10, window: float = 60.0,
+                 open_timeout: float = 30.0, outage_timeout: float = 900.0):
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.window = window
+        self.open_timeout = open_timeout
+        self.outage_timeout = outage_timeout
+        
+        self.state = self.CLOSED
+        self.outcomes = deque()
+        self.opened_at = 0.0
+        self.probe_started_at = None
+        self.parked = 0
+        self._changed = asyncio.Event()
+    
+    @classmethod
+    def from_config(cls, settings: dict) -> "CircuitBreaker":
+        """Создание автомата из секции circuit_breaker конфигурации"""
+        return cls(
+            failure_ratio=settings.get("failure_ratio", 0.5),
+            min_requests=settings.get("min_requests", 10),
+            window=settings.get("window", 60.0),
+            open_timeout=settings.get("open_timeout", 30.0),
+            outage_timeout=settings.get("outage_timeout", 900.0),
+        )
+    
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"Автомат защиты API: {self.state} -> {state}")
+            self.state = state
+        self._changed.set()
+        self._changed = asyncio.Event()
+    
+    def _try_pass(self) -> bool:
+        now = time.monotonic()
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and now - self.opened_at >= self.open_timeout:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            # Пробный запрос, потерянный при отмене, не должен блокировать автомат навсегда
+            if self.probe_started_at is None or now - self.probe_started_at >= self.open_timeout:
+                self.probe_started_at = now
+                return True
+        return False
+    
+    def _next_attempt_at(self) -> float:
+        """Момент, когда парковка может закончиться без смены состояния"""
+        if self.state == self.HALF_OPEN and self.probe_started_at is not None:
+            # Пробный запрос в полете: ждем его ответа или признания потерянным
+            return self.probe_started_at + self.open_timeout
+        return self.opened_at + self.open_timeout
+    
+    async def acquire(self):
+        """Разрешение на запрос; во время сбоя запрос паркуется до восстановления API"""
+        if self._try_pass():
+            return
+        parked_at = time.monotonic()
+        self.parked += 1
+        try:
+            while not self._try_pass():
+                waited = time.monotonic() - parked_at
+                if waited >= self.outage_timeout:
+                    raise CircuitOpenError(f"API недоступно более {int(self.outage_timeout)} сек")
+                until_probe = max(self._next_attempt_at() - time.monotonic(), 0.0)
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._changed.wait(),
+                                           min(until_probe, self.outage_timeout - waited))
+        finally:
+            self.parked -= 1
+    
+    def _record(self, failed: bool):
+        now = time.monotonic()
+        self.outcomes.append((now, failed))
+        while self.outcomes and now - self.outcomes[0][0] > self.window:
+            self.outcomes.popleft()
+    
+    def record_success(self):
+        if self.state != self.CLOSED:
+            self.outcomes.clear()
+            self.probe_started_at = None
+            self._set_state(self.CLOSED)
+            return
+        self._record(False)
+    
+    def record_failure(self):
+        if self.state != self.CLOSED:
+            self.opened_at = time.monotonic()
+            self.probe_started_at = None
+            self._set_state(self.OPEN)
+            return
+        self._record(True)
+        failures = sum(1 for _, failed in self.outcomes if failed)
+        if len(self.outcomes) >= self.min_requests and failures / len(self.outcomes) >= self.failure_ratio:
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+
 class LZTMarketBot:
     def __init__(self, config_manager: ConfigManager):
         self.config_manager = config_manager
@@ -129,13 +1533,101 @@ class LZTMarketBot:
         
         self.lzt_token = config["api_tokens"]["lzt_token"]
         self.user_id = config["api_tokens"]["user_id"]
-        self.base_url = "https://prod-api.lzt.market"
+        self.base_url = config.get("http", {}).get("base_url", "https://prod-api.lzt.market")
         
         self.headers = {
             "accept": "application/json",
             "content-type": "application/json",
             "authorization": f"Bearer {self.lzt_token}"
         }
+        
+        self.rate_limiter = AdaptiveRateLimiter.from_config(config.get("rate_limit", {}))
+        self.circuit_breaker = CircuitBreaker.from_config(config.get("circuit_breaker", {}))
+        self.payload_cache = {}
+        self.payload_cache_version = config_manager.settings_version
+        self.session = None
+        # aiohttp.TraceConfig для внешних замеров (бенчмарки, метрики)
+        self.trace_configs = []
+        
+        self.inventory = InventoryIndex()
+        # Текущая загрузка списка товаров: одновременные вызовы ждут ее, а не запускают свою
+        self.inventory_refresh = None
+        self.inventory_stale_after = config.get("inventory", {}).get("stale_after", 60)
+        self.inventory_ttl = config.get("inventory", {}).get("ttl", 30)
+        
+        self.jobs = UploadJobStore(config.get("jobs", {}).get("database", "upload_jobs.db"))
+        self.leases = ItemLeaseStore(self.jobs.db, ttl=config.get("leases", {}).get("ttl", 600))
+        self.max_attempts = config.get("retry", {}).get("max_attempts", 5)
+    
+    async def start(self):
+        """Открытие общей HTTP-сессии с пулом keep-alive соединений"""
+        if self.session is not None and not self.session.closed:
+            return
+        http_settings = self.config_manager.config.get("http", {})
+        connector = aiohttp.TCPConnector(
+            limit=http_settings.get("connection_limit", 50),
+            limit_per_host=http_settings.get("connection_limit_per_host", 20),
+            ttl_dns_cache=http_settings.get("dns_cache_ttl", 300),
+            keepalive_timeout=http_settings.get("keepalive_timeout", 60),
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=http_settings.get("request_timeout", 30)),
+            trace_configs=self.trace_configs or None,
+        )
+        logger.info("HTTP-сессия LZT Market открыта")
+    
+    async def close(self):
+        """Закрытие общей HTTP-сессии"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.info("HTTP-сессия LZT Market закрыта")
+        self.session = None
+    
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Общая сессия бота, открывается при первом обращении"""
+        if self.session is None or self.session.closed:
+            await self.start()
+        return self.session
+    
+    @contextlib.asynccontextmanager
+    async def api_request(self, method: str, path: str, **kwargs):
+        """Запрос к API через автомат защиты и адаптивный rate limiter"""
+        await self.circuit_breaker.acquire()
+        session = await self.get_session()
+        await self.rate_limiter.acquire()
+        
+        endpoint = api_endpoint(method, path)
+        started = time.monotonic()
+        API_IN_FLIGHT.inc()
+        try:
+            try:
+                response = await session.request(method, f"{self.base_url}{path}", **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.circuit_breaker.record_failure()
+                API_REQUESTS.inc(endpoint=endpoint, status="error")
+                API_LATENCY.observe(time.monotonic() - started, endpoint=endpoint, status="error")
+                raise
+            # Время ответа сервера без ожидания в rate limiter
+            response.latency = time.monotonic() - started
+            API_REQUESTS.inc(endpoint=endpoint, status=response.status)
+            API_LATENCY.observe(response.latency, endpoint=endpoint, status=response.status)
+            
+            async with response:
+                if response.status == 429:
+                    API_RATE_LIMITED.inc(endpoint=endpoint)
+                    self.rate_limiter.on_rate_limited(parse_retry_after(response.headers.get("Retry-After")))
+                else:
+                    self.rate_limiter.on_success()
+                
+                if response.status >= 500:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                yield response
+        finally:
+            API_IN_FLIGHT.dec()
     
     def get_payload_template(self):
         """Получить шаблон payload с текущими настройками"""
@@ -153,224 +1645,755 @@ class LZTMarketBot:
             "extra": settings.get("extra", {"service": "telegram"})
         }
     
-    def normalize_link(self, link: str) -> str:
-        """Нормализация ссылки к формату https://t.me/giftcode/..."""
-        match = re.search(r't\.me/giftcode/([a-zA-Z0-9_-]+)', link)
-        if match:
-            code = match.group(1)
-            return f"https://t.me/giftcode/{code}"
-        return link
+    def compiled_payload(self, duration_days: int) -> CompiledPayload:
+        """Предсобранный payload для длительности с текущими настройками (с кэшем)"""
+        if self.payload_cache_version != self.config_manager.settings_version:
+            self.payload_cache.clear()
+            self.payload_cache_version = self.config_manager.settings_version
+        
+        template = self.get_payload_template()
+        key = (duration_days, template["currency"], template["item_origin"])
+        compiled = self.payload_cache.get(key)
+        if compiled is None:
+            title_mapping = self.config_manager.config.get("title_mapping", {})
+            titles = title_mapping.get(str(duration_days), {})
+            # В bot_config.json заголовки вложены в "title", старый формат хранит ru/en напрямую
+            titles = titles.get("title", titles)
+            template["title"] = titles.get("ru", "")
+            template["title_en"] = titles.get("en", "")
+            compiled = self.payload_cache[key] = CompiledPayload(template, duration_days)
+        return compiled
     
     def extract_links(self, text: str) -> list:
-        """Извлечение всех ссылок из текста"""
-        links = re.findall(r'(?:https?://)?t\.me/giftcode/[a-zA-Z0-9_-]+', text)
-        return [self.normalize_link(link) for link in links]
+        """Извлечение всех ссылок из текста без повторов"""
+        return list(iter_links(text))
+    
+    def new_retry_scheduler(self) -> RetryScheduler:
+        """Отдельная очередь повторов для каждой операции"""
+        return RetryScheduler.from_config(self.config_manager.config.get("retry", {}))
     
-    async def check_if_account_exists(self, session: aiohttp.ClientSession, login: str) -> bool:
+    async def refresh_inventory(self, max_age: float = 0) -> dict:
+        """Перезагрузка индекса товаров, если он старше max_age секунд.
+        
+        Одновременные вызовы ждут одну общую загрузку и получают ее результат,
+        в том числе ошибку. Отмена одного ожидающего не прерывает загрузку
+        для остальных.
+        """
+        if self.inventory.age() <= max_age:
+            return {"success": True}
+        if self.inventory_refresh is None or self.inventory_refresh.done():
+            self.inventory_refresh = asyncio.create_task(self.get_user_items())
+        return await asyncio.shield(self.inventory_refresh)
+    
+    async def get_inventory(self) -> dict:
+        """Общий снимок товаров продавца не старше inventory_ttl секунд.
+        
+        Загрузки и удаления через бота обновляют снимок на месте, поэтому
+        между полными загрузками он остается актуальным.
+        """
+        result = await self.refresh_inventory(max_age=self.inventory_ttl)
+        if not result["success"]:
+            return result
+        return {"success": True, "data": {"items": self.inventory.items()}}
+    
+    async def check_if_account_exists(self, login: str) -> bool:
         """Проверка существует ли аккаунт уже на маркете"""
+        if login in self.inventory:
+            return True
+        # Товар мог быть выставлен не через бота — сверяемся со свежим индексом
+        await self.refresh_inventory(max_age=self.inventory_stale_after)
+        return login in self.inventory
+    
+    async def upload_account_async(self, login: str, price: int, duration_days: int, index: int,
+                                   attempt: int = 0, max_attempts: int = 5, payload: CompiledPayload = None) -> dict:
+        """Одна попытка загрузки аккаунта на LZT Market.
+        
+        Временные ошибки (429, таймаут, сеть) возвращаются с "retry": True —
+        повтор планирует пул воркеров, а не эта корутина. payload — снимок
+        настроек задания; без него берутся текущие настройки.
+        """
+        if payload is None:
+            payload = self.compiled_payload(duration_days)
+        
         try:
-            normalized_login = login.replace("https://t.me/giftcode/", "")
-            url = f"{self.base_url}/user/items"
-            params = {
-                "user_id": self.user_id,
-                "category_id": 30
-            }
-            
-            async with session.get(url, params=params, headers=self.headers, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    items = data.get("items", [])
+            async with self.api_request("POST", "/item/fast-sell", data=payload.render(login, price)) as response:
+                response_text = await response.text()
+                
+                if response.status == 429:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    logger.warning(f"Аккаунт {index}: 429 Too Many Requests, попытка {attempt + 1}/{max_attempts}")
+                    return {"success": False, "error": "429 Too Many Requests", "index": index, "detailed_error": response_text,
+                            "login": login, "retry": True, "retry_after": retry_after}
+                
+                if response.status in [200, 201]:
+                    try:
+                        data = await response.json()
+                        logger.info(f"Аккаунт {index}: успешно загружен")
+                        item = data.get("item") or {}
+                        self.inventory.add({"item_id": item.get("item_id"), "login": login, "gifts_duration": duration_days})
+                        return {"success": True, "data": data, "status_code": response.status, "index": index, "login": login}
+                    except:
+                        logger.info(f"Аккаунт {index}: загружен (нет JSON в ответе)")
+                        self.inventory.add({"item_id": None, "login": login, "gifts_duration": duration_days})
+                        return {"success": True, "data": {"item": {}}, "status_code": response.status, "index": index, "login": login}
+                
+                error_message = f"Status {response.status}"
+                try:
+                    error_data = await response.json()
+                    if "errors" in error_data:
+                        errors = error_data["errors"]
+                        if isinstance(errors, dict):
+                            error_messages = []
+                            for field, messages in errors.items():
+                                if isinstance(messages, list):
+                                    error_messages.extend(messages)
+                                else:
+                                    error_messages.append(str(messages))
+                            error_message = "; ".join(error_messages)
+                        elif isinstance(errors, list):
+                            error_message = "; ".join(errors)
+                        else:
+                            error_message = str(errors)
+                    elif "error" in error_data:
+                        error_message = error_data["error"]
                     
-                    for item in items:
-                        item_login = item.get("login", "")
-                        if normalized_login in item_login or item_login in normalized_login:
-                            return True
-            return False
+                    if "уже продается" in error_message.lower() or "already" in error_message.lower():
+                        exists = await self.check_if_account_exists(login)
+                        if exists:
+                            logger.info(f"Аккаунт {index}: пропускаем, уже продается на маркете")
+                            return {"success": False, "error": error_message, "index": index, "login": login, "skip_error": True}
+                except:
+                    pass
+                
+                logger.error(f"Аккаунт {index}: Ошибка {response.status} - {error_message}")
+                # Ошибки сервера временные: повтор дождется восстановления API
+                return {"success": False, "error": error_message, "index": index, "detailed_error": response_text,
+                        "login": login, "retry": response.status >= 500}
+        
+        except CircuitOpenError as e:
+            logger.error(f"Аккаунт {index}: {e}")
+            return {"success": False, "error": str(e), "index": index, "login": login}
+        except asyncio.TimeoutError:
+            logger.error(f"Аккаунт {index}: Таймаут запроса, попытка {attempt + 1}/{max_attempts}")
+            return {"success": False, "error": "Таймаут запроса", "index": index, "login": login, "retry": True}
         except Exception as e:
-            logger.error(f"Ошибка проверки существования аккаунта: {e}")
-            return False
+            logger.error(f"Аккаунт {index}: Исключение {str(e)}, попытка {attempt + 1}/{max_attempts}")
+            return {"success": False, "error": str(e), "index": index, "login": login, "retry": True}
     
-    async def upload_account_async(self, session: aiohttp.ClientSession, login: str, price: int, duration_days: int, index: int, max_retries: int = 5) -> dict:
-        """Асинхронная загрузка одного аккаунта на LZT Market с повторными попытками"""
-        url = f"{self.base_url}/item/fast-sell"
+    def preflight_links(self, entries):
+        """Отсев дубликатов до загрузки без запросов к API.
         
-        payload = self.get_payload_template()
-        payload["login"] = login
-        payload["price"] = price
+        Принимает пары (позиция, ссылка) и выдает тройки (позиция, ссылка,
+        причина пропуска или None): повтор внутри списка и коды, которые уже
+        есть в индексе товаров продавца.
+        """
+        seen_codes = set()
+        for index, link in entries:
+            code = giftcode_of(link)
+            if code in seen_codes:
+                yield index, link, "Дубликат в списке ссылок"
+            elif link in self.inventory:
+                seen_codes.add(code)
+                yield index, link, "Уже продается на маркете"
+            else:
+                seen_codes.add(code)
+                yield index, link, None
+    
+    async def upload_entries(self, entries, price: int, duration_days: int, concurrency: int = 5, job_id: int = None,
+                             on_result=None, collect: bool = True) -> list:
+        """Загрузка пар (позиция, ссылка) пулом воркеров с записью состояний в задание"""
+        # Настройки фиксируются на старте: смена валюты во время загрузки не смешает payload
+        payload = self.compiled_payload(duration_days)
         
-        # Получаем заголовки из конфигурации
-        title_mapping = self.config_manager.config.get("title_mapping", {})
-        titles = title_mapping.get(str(duration_days), {})
-        payload["title"] = titles.get("ru", "")
-        payload["title_en"] = titles.get("en", "")
+        # Один общий снимок товаров вместо проверки каждого дубликата после ошибки API
+        inventory = await self.refresh_inventory(max_age=self.inventory_stale_after)
+        unchecked = set()
+        if not inventory["success"]:
+            if job_id is not None:
+                # Ссылки, прерванные в полете, могли уже выставиться: без индекса их не отправляем
+                unchecked = self.jobs.in_flight_positions(job_id)
+            logger.warning(f"Индекс товаров не загружен ({inventory.get('error')}), проверка дубликатов до загрузки "
+                           f"неполная; ссылок, ждущих проверки после перезапуска: {len(unchecked)}")
         
-        for attempt in range(max_retries):
-            try:
-                if attempt > 0:
-                    delay = min(2 ** attempt, 30)
-                    logger.info(f"Аккаунт {index}: попытка {attempt + 1}/{max_retries}, задержка {delay}с")
-                    await asyncio.sleep(delay)
-                
-                async with session.post(url, json=payload, headers=self.headers, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                    response_text = await response.text()
-                    
-                    if response.status in [200, 201]:
-                        try:
-                            data = await response.json()
-                            logger.info(f"Аккаунт {index}: успешно загружен")
-                            return {"success": True, "data": data, "status_code": response.status, "index": index, "login": login}
-                        except:
-                            logger.info(f"Аккаунт {index}: загружен (нет JSON в ответе)")
-                            return {"success": True, "data": {"item": {}}, "status_code": response.status, "index": index, "login": login}
-                    
-                    elif response.status == 429:
-                        logger.warning(f"Аккаунт {index}: 429 Too Many Requests, попытка {attempt + 1}/{max_retries}")
-                        if attempt == max_retries - 1:
-                            return {"success": False, "error": "429 Too Many Requests", "index": index, "detailed_error": response_text, "login": login}
-                        continue
-                    
-                    else:
-                        error_message = f"Status {response.status}"
-                        try:
-                            error_data = await response.json()
-                            if "errors" in error_data:
-                                errors = error_data["errors"]
-                                if isinstance(errors, dict):
-                                    error_messages = []
-                                    for field, messages in errors.items():
-                                        if isinstance(messages, list):
-                                            error_messages.extend(messages)
-                                        else:
-                                            error_messages.append(str(messages))
-                                    error_message = "; ".join(error_messages)
-                                elif isinstance(errors, list):
-                                    error_message = "; ".join(errors)
-                                else:
-                                    error_message = str(errors)
-                            elif "error" in error_data:
-                                error_message = error_data["error"]
-                            
-                            if "уже продается" in error_message.lower() or "already" in error_message.lower():
-                                exists = await self.check_if_account_exists(session, login)
-                                if exists:
-                                    logger.info(f"Аккаунт {index}: пропускаем, уже продается на маркете")
-                                    return {"success": False, "error": error_message, "index": index, "login": login, "skip_error": True}
-                        except:
-                            pass
-                        
-                        logger.error(f"Аккаунт {index}: Ошибка {response.status} - {error_message}")
-                        return {"success": False, "error": error_message, "index": index, "detailed_error": response_text, "login": login}
-                        
-            except asyncio.TimeoutError:
-                logger.error(f"Аккаунт {index}: Таймаут запроса, попытка {attempt + 1}/{max_retries}")
-                if attempt == max_retries - 1:
-                    return {"success": False, "error": "Таймаут запроса", "index": index, "login": login}
-            except Exception as e:
-                logger.error(f"Аккаунт {index}: Исключение {str(e)}, попытка {attempt + 1}/{max_retries}")
-                if attempt == max_retries - 1:
-                    return {"success": False, "error": str(e), "index": index, "login": login}
+        async def handle(entry, position, attempt):
+            index, link, skip_reason = entry
+            if index in unchecked:
+                recheck = await self.refresh_inventory(max_age=self.inventory_stale_after)
+                if not recheck["success"]:
+                    return {"success": False, "error": "Индекс товаров недоступен для проверки после перезапуска",
+                            "index": index, "login": link, "retry": True}
+                unchecked.discard(index)
+                if link in self.inventory:
+                    skip_reason = "Уже продается на маркете"
+            if skip_reason:
+                logger.info(f"Аккаунт {index}: пропускаем без запроса — {skip_reason}")
+                return {"success": False, "error": skip_reason, "index": index, "login": link, "skip_error": True}
+            if job_id is not None and attempt == 0:
+                self.jobs.mark(job_id, index, UploadJobStore.IN_FLIGHT)
+            return await self.upload_account_async(link, price, duration_days, index, attempt, self.max_attempts, payload)
         
-        return {"success": False, "error": "Превышено количество попыток", "index": index, "login": login}
-    
-    async def upload_accounts_batch(self, links: list, price: int, duration_days: int, batch_size: int = 5) -> list:
-        """Загрузка аккаунтов пачками с увеличенными задержками"""
-        results = []
+        def record(position, result):
+            if job_id is not None:
+                self.jobs.record_result(job_id, result)
+            if on_result is not None:
+                on_result(position, result)
         
-        async with aiohttp.ClientSession() as session:
-            for i in range(0, len(links), batch_size):
-                batch = links[i:i + batch_size]
-                logger.info(f"Обработка пачки {i//batch_size + 1}: аккаунты {i+1}-{min(i+batch_size, len(links))}")
-                
-                tasks = [
-                    self.upload_account_async(session, link, price, duration_days, i + idx + 1)
-                    for idx, link in enumerate(batch)
-                ]
-                batch_results = await asyncio.gather(*tasks)
-                results.extend(batch_results)
-                
-                if i + batch_size < len(links):
-                    delay = 2
-                    logger.info(f"Задержка {delay}с перед следующей пачкой")
-                    await asyncio.sleep(delay)
+        return await run_worker_pool(self.preflight_links(entries), handle, concurrency,
+                                     max_attempts=self.max_attempts, retry_scheduler=self.new_retry_scheduler(),
+                                     on_result=record, name="upload", collect=collect)
+    
+    async def upload_accounts_batch(self, links: list, price: int, duration_days: int, concurrency: int = 5) -> list:
+        """Загрузка аккаунтов пулом воркеров, темп запросов задает адаптивный rate limiter"""
+        logger.info(f"Загрузка {len(links)} аккаунтов, одновременных запросов: {concurrency}")
+        return await self.upload_entries(enumerate(links, start=1), price, duration_days, concurrency)
+    
+    async def run_upload_job(self, job_id: int, concurrency: int = 5, on_result=None, collect: bool = True) -> list:
+        """Выполнение незавершенной части задания загрузки"""
+        job = self.jobs.get_job(job_id)
+        entries = self.jobs.iter_unfinished_links(job_id)
+        logger.info(f"Задание {job_id}: осталось загрузить {self.jobs.count_unfinished(job_id)} аккаунтов, "
+                    f"одновременных запросов: {concurrency}")
         
+        results = await self.upload_entries(entries, job["price"], job["duration_days"], concurrency, job_id=job_id,
+                                            on_result=on_result, collect=collect)
+        self.jobs.finish_job(job_id)
         return results
     
-    def get_user_items(self) -> dict:
-        """Получение списка товаров пользователя"""
-        url = f"{self.base_url}/user/items"
+    async def fetch_items_page(self, page: int, attempt: int = 0, max_attempts: int = 5) -> dict:
+        """Одна попытка загрузки страницы списка товаров пользователя.
+        
+        429, ошибки сервера и сети возвращаются с "retry": True — повтор
+        планирует пул воркеров; остальные ошибки окончательные.
+        """
         params = {
             "user_id": self.user_id,
-            "category_id": 30
+            "category_id": 30,
+            "page": page
         }
         
         try:
-            response = requests.get(url, params=params, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            return {"success": True, "data": response.json()}
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка получения товаров: {e}")
-            return {"success": False, "error": str(e)}
-    
-    async def delete_item_async(self, session: aiohttp.ClientSession, item_id: int, retry_count: int = 5) -> dict:
-        """Асинхронное удаление товара с повторными попытками"""
-        url = f"{self.base_url}/{item_id}"
-        payload = {"reason": "Выдача в телеграм"}
-        
-        for attempt in range(retry_count):
-            try:
-                if attempt > 0:
-                    delay = min(2 ** attempt, 30)
-                    logger.info(f"Удаление {item_id}: попытка {attempt + 1}/{retry_count}, задержка {delay}с")
-                    await asyncio.sleep(delay)
+            async with self.api_request("GET", "/user/items", params=params) as response:
+                if response.status == 200:
+                    return {"success": True, "page": page, "data": await response.json()}
                 
-                async with session.delete(url, json=payload, headers=self.headers, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                    if response.status in [200, 204]:
-                        logger.info(f"Товар {item_id}: успешно удален")
-                        return {"success": True, "item_id": item_id}
-                    else:
-                        error_text = await response.text()
-                        logger.warning(f"Товар {item_id}: статус {response.status}, попытка {attempt + 1}/{retry_count}")
-                        
-                        if response.status == 429 and attempt < retry_count - 1:
-                            continue
-                        
-                        if attempt == retry_count - 1:
-                            return {"success": False, "item_id": item_id, "error": f"Status {response.status}", "detailed_error": error_text}
-                            
-            except Exception as e:
-                logger.warning(f"Товар {item_id}: исключение {str(e)}, попытка {attempt + 1}/{retry_count}")
-                if attempt == retry_count - 1:
-                    return {"success": False, "item_id": item_id, "error": str(e)}
+                retry = response.status == 429 or response.status >= 500
+                retry_after = parse_retry_after(response.headers.get("Retry-After")) if response.status == 429 else None
+                logger.warning(f"Страница товаров {page}: статус {response.status}, попытка {attempt + 1}/{max_attempts}")
+                return {"success": False, "page": page, "error": f"Status {response.status}",
+                        "retry": retry, "retry_after": retry_after}
+        except CircuitOpenError as e:
+            logger.warning(f"Страница товаров {page}: {e}")
+            return {"success": False, "page": page, "error": str(e)}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Страница товаров {page}: ошибка {e!r}, попытка {attempt + 1}/{max_attempts}")
+            return {"success": False, "page": page, "error": str(e) or type(e).__name__, "retry": True}
+    
+    async def fetch_items_pages(self, pages, concurrency: int) -> list:
+        """Загрузка страниц пулом воркеров, повторы ждут в отложенной очереди"""
+        async def handle(page, position, attempt):
+            return await self.fetch_items_page(page, attempt, self.max_attempts)
+        
+        return await run_worker_pool(pages, handle, concurrency,
+                                     max_attempts=self.max_attempts, retry_scheduler=self.new_retry_scheduler(),
+                                     name="inventory")
+    
+    async def get_user_items(self, concurrency: int = 4) -> dict:
+        """Получение полного списка товаров пользователя со всех страниц"""
+        first_page = (await self.fetch_items_pages([1], 1))[0]
+        if not first_page["success"]:
+            logger.error(f"Ошибка получения товаров: {first_page['error']}")
+            return {"success": False, "error": first_page["error"]}
+        
+        items = first_page["data"].get("items", [])
+        total = first_page["data"].get("totalItems", len(items))
+        per_page = first_page["data"].get("perPage") or len(items)
         
-        return {"success": False, "item_id": item_id, "error": "Превышено количество попыток"}
+        if per_page and total > per_page:
+            pages = range(2, (total + per_page - 1) // per_page + 1)
+            for result in await self.fetch_items_pages(pages, concurrency):
+                if not result["success"]:
+                    # Неполный снимок пропустил бы дубликаты, поэтому индекс не заменяется
+                    logger.error(f"Ошибка получения товаров: страница {result['page']}: {result['error']}")
+                    return {"success": False, "error": result["error"]}
+                items.extend(result["data"].get("items", []))
+        
+        # Страницы сдвигаются, если товары продаются во время обхода
+        unique_items = {}
+        for item in items:
+            unique_items.setdefault(item.get("item_id"), item)
+        items = list(unique_items.values())
+        
+        self.inventory.replace(items)
+        logger.info(f"Получено товаров: {len(items)} из {total}")
+        return {"success": True, "data": {"items": items, "totalItems": total}}
     
-    async def delete_items_batch(self, item_ids: list, batch_size: int = 3) -> list:
-        """Удаление товаров пачками с задержками"""
-        results = []
+    async def delete_item_async(self, item_id: int, attempt: int = 0, max_attempts: int = 5) -> dict:
+        """Одна попытка удаления товара.
+        
+        429, ошибки сервера и сети возвращаются с "retry": True, остальные
+        ошибки окончательные. 404 означает, что товара на маркете уже нет:
+        он убирается из индекса и помечается "gone": True.
+        """
+        payload = {"reason": "Выдача в телеграм"}
         
-        async with aiohttp.ClientSession() as session:
-            for i in range(0, len(item_ids), batch_size):
-                batch = item_ids[i:i + batch_size]
-                logger.info(f"Удаление пачки {i//batch_size + 1}: товары {i+1}-{min(i+batch_size, len(item_ids))}")
+        try:
+            async with self.api_request("DELETE", f"/{item_id}", json=payload) as response:
+                retry_after = None
+                if response.status == 429:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
                 
-                tasks = [
-                    self.delete_item_async(session, item_id)
-                    for item_id in batch
-                ]
-                batch_results = await asyncio.gather(*tasks)
-                results.extend(batch_results)
+                if response.status in [200, 204]:
+                    logger.info(f"Товар {item_id}: успешно удален")
+                    self.inventory.remove(item_id)
+                    return {"success": True, "item_id": item_id, "latency": response.latency}
                 
-                if i + batch_size < len(item_ids):
-                    delay = 1.5
-                    logger.info(f"Задержка {delay}с перед следующей пачкой удаления")
-                    await asyncio.sleep(delay)
+                error_text = await response.text()
+                gone = response.status == 404
+                if gone:
+                    self.inventory.remove(item_id)
+                retry = response.status == 429 or response.status >= 500
+                logger.warning(f"Товар {item_id}: статус {response.status}, попытка {attempt + 1}/{max_attempts}")
+                return {"success": False, "item_id": item_id, "error": f"Status {response.status}", "detailed_error": error_text,
+                        "status_code": response.status, "latency": response.latency, "retry": retry,
+                        "retry_after": retry_after, "gone": gone}
+        
+        except CircuitOpenError as e:
+            logger.warning(f"Товар {item_id}: {e}")
+            return {"success": False, "item_id": item_id, "error": str(e)}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Товар {item_id}: исключение {e!r}, попытка {attempt + 1}/{max_attempts}")
+            return {"success": False, "item_id": item_id, "error": str(e) or type(e).__name__, "retry": True}
+    
+    async def delete_items_batch(self, item_ids: list, concurrency: int = None, on_result=None,
+                                 collect: bool = True) -> list:
+        """Удаление товаров пулом воркеров, повторы ждут в отложенной очереди.
         
+        Без concurrency число одновременных запросов подбирает
+        AdaptiveConcurrencyLimiter по задержкам и ответам 429.
+        """
+        limiter = None
+        if concurrency is None:
+            limiter = AdaptiveConcurrencyLimiter.from_config(self.config_manager.config.get("delete_concurrency", {}))
+            concurrency = limiter.max_limit
+            logger.info(f"Удаление {len(item_ids)} товаров, адаптивная параллельность с {int(limiter.limit)}")
+        else:
+            logger.info(f"Удаление {len(item_ids)} товаров, одновременных запросов: {concurrency}")
+        
+        async def handle(item_id, position, attempt):
+            if limiter is None:
+                return await self.delete_item_async(item_id, attempt, self.max_attempts)
+            
+            await limiter.acquire()
+            started = time.monotonic()
+            result = {"success": False, "item_id": item_id}
+            try:
+                result = await self.delete_item_async(item_id, attempt, self.max_attempts)
+                return result
+            finally:
+                status = result.get("status_code")
+                # Сетевые ошибки, таймауты, 429 и 5xx — признаки перегрузки; 404 и подобные — нет
+                congested = not result["success"] and (status is None or status == 429 or status >= 500)
+                limiter.release(result.get("latency", time.monotonic() - started), congested)
+        
+        results = await run_worker_pool(item_ids, handle, concurrency,
+                                        max_attempts=self.max_attempts, retry_scheduler=self.new_retry_scheduler(),
+                                        on_result=on_result, name="delete", collect=collect)
+        if limiter is not None:
+            logger.info(f"Удаление завершено, пиковая параллельность: {limiter.peak}")
         return results
 
 
+def pack_messages(lines, header: str = "", separator: str = "\n", limit: int = MAX_MESSAGE_LENGTH):
+    """Склейка строк отчета в сообщения не длиннее limit.
+    
+    Сообщения режутся по границам строк; первое начинается с header.
+    Строка длиннее лимита (на практике не встречается) режется по limit.
+    """
+    current = header
+    filled = False
+    for line in lines:
+        for start in range(0, max(len(line), 1), limit):
+            piece = line[start:start + limit]
+            addition = separator + piece if filled else piece
+            if current and len(current) + len(addition) > limit:
+                yield current
+                current, addition = "", piece
+            current += addition
+            filled = True
+    if current:
+        yield current
+
+
+class OutboundQueue:
+    """Единая точка отправки сообщений Telegram с учетом flood-лимитов.
+    
+    Общий token bucket держит глобальный темп бота, отдельный bucket на
+    каждый чат — темп внутри чата. Отправки в один чат идут строго по
+    очереди, RetryAfter выдерживается и сообщение отправляется повторно.
+    Состояние чата, не использовавшегося idle_ttl секунд, удаляется.
+    
+    Через очередь идут массовые отправки: отчеты, прогресс, выдача. Ответы
+    обработчиков на сообщение пользователя (по одному на апдейт) идут
+    напрямую через reply_text и не ждут отчетов, занявших очередь чата.
+    """
+    
+    def __init__(self, bot, global_rate: float = 25.0, chat_rate: float = 1.0, chat_burst: int = 3,
+                 max_attempts: int = 5, idle_ttl: float = 600.0):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.idle_ttl = idle_ttl
+        self.global_limiter = AdaptiveRateLimiter(rate=global_rate, burst=int(global_rate),
+                                                  min_rate=1.0, max_rate=global_rate)
+        self.chat_limiters = {}
+        self.chat_locks = {}
+        self.chat_used = {}
+        self.last_sweep = time.monotonic()
+    
+    @classmethod
+    def from_config(cls, bot, settings: dict) -> "OutboundQueue":
+        """Создание очереди из секции outbound конфигурации"""
+        return cls(
+            bot,
+            global_rate=settings.get("global_rate", 25.0),
+            chat_rate=settings.get("chat_rate", 1.0),
+            chat_burst=settings.get("chat_burst", 3),
+            max_attempts=settings.get("max_attempts", 5),
+            idle_ttl=settings.get("idle_ttl", 600.0),
+        )
+    
+    def _touch(self, chat_id):
+        """Отметка использования чата; раз в idle_ttl удаляются простаивающие чаты"""
+        now = time.monotonic()
+        self.chat_used[chat_id] = now
+        if now - self.last_sweep < self.idle_ttl:
+            return
+        self.last_sweep = now
+        for idle_chat, used_at in list(self.chat_used.items()):
+            if now - used_at < self.idle_ttl:
+                continue
+            lock = self.chat_locks.get(idle_chat)
+            limiter = self.chat_limiters.get(idle_chat)
+            # Занятая очередь и невыдержанный RetryAfter должны пережить очистку
+            if (lock is not None and lock.locked()) or (limiter is not None and limiter.blocked_until > now):
+                continue
+            del self.chat_used[idle_chat]
+            self.chat_locks.pop(idle_chat, None)
+            self.chat_limiters.pop(idle_chat, None)
+    
+    def _chat_lock(self, chat_id) -> asyncio.Lock:
+        self._touch(chat_id)
+        return self.chat_locks.setdefault(chat_id, asyncio.Lock())
+    
+    def _chat_limiter(self, chat_id) -> AdaptiveRateLimiter:
+        self._touch(chat_id)
+        limiter = self.chat_limiters.get(chat_id)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(rate=self.chat_rate, burst=self.chat_burst,
+                                          min_rate=self.chat_rate / 10, max_rate=self.chat_rate)
+            self.chat_limiters[chat_id] = limiter
+        return limiter
+    
+    async def _call(self, chat_id, method, *args, attempts: int = None, **kwargs):
+        """Вызов метода Bot API в темпе чата и бота, RetryAfter приводит к повтору"""
+        chat_limiter = self._chat_limiter(chat_id)
+        attempts = attempts or self.max_attempts
+        for attempt in range(attempts):
+            await chat_limiter.acquire()
+            await self.global_limiter.acquire()
+            try:
+                result = await method(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                retry_after = getattr(retry_after, "total_seconds", lambda: retry_after)()
+                logger.warning(f"Чат {chat_id}: flood-лимит Telegram, пауза {retry_after} сек, "
+                               f"попытка {attempt + 1}/{attempts}")
+                chat_limiter.on_rate_limited(retry_after)
+                if attempt == attempts - 1:
+                    raise
+                continue
+            chat_limiter.on_success()
+            self.global_limiter.on_success()
+            return result
+    
+    async def send(self, chat_id, text: str, **kwargs):
+        """Отправка одного сообщения, возвращает отправленное сообщение"""
+        async with self._chat_lock(chat_id):
+            return await self._call(chat_id, self.bot.send_message, chat_id, text, **kwargs)
+    
+    async def send_lines(self, chat_id, lines, header: str = "", separator: str = "\n"):
+        """Отправка отчета, склеенного в минимум сообщений, без вклинивания других отправок в чат"""
+        async with self._chat_lock(chat_id):
+            for text in pack_messages(lines, header, separator):
+                await self._call(chat_id, self.bot.send_message, chat_id, text)
+    
+    async def send_document(self, chat_id, path, filename: str, caption: str = None):
+        """Отправка файла; при повторе после RetryAfter файл открывается заново"""
+        async with self._chat_lock(chat_id):
+            return await self._call(chat_id, self.bot.send_document, chat_id, Path(path),
+                                    filename=filename, caption=caption)
+    
+    async def edit(self, message, text: str):
+        """Редактирование сообщения; при flood-лимите правка пропускается, а не ждет"""
+        return await self._call(message.chat_id, message.edit_text, text, attempts=1)
+
+
+class ProgressReporter:
+    """Одно сообщение о ходе задания, которое редактируется не чаще edit_interval.
+    
+    Счетчики обновляет on_result пула воркеров, а фоновая задача раз в
+    интервал перерисовывает сообщение, если что-то изменилось. Скорость
+    считается по последним завершениям, поэтому отражает текущий темп.
+    """
+    
+    def __init__(self, message, user_id: str, header: str, total: int, edit_interval: float = 2.0, window: int = 50):
+        self.message = message
+        self.user_id = user_id
+        self.header = header
+        self.total = total
+        self.edit_interval = edit_interval
+        self.success = 0
+        self.errors = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+        self.completions = deque([self.started_at], maxlen=window)
+        self.rendered = None
+        self.task = None
+    
+    @property
+    def done(self) -> int:
+        return self.success + self.errors + self.skipped
+    
+    def on_result(self, position, result):
+        if result.get("success"):
+            self.success += 1
+        elif result.get("skip_error", False):
+            self.skipped += 1
+        else:
+            self.errors += 1
+        self.completions.append(time.monotonic())
+    
+    def speed(self) -> float:
+        elapsed = self.completions[-1] - self.completions[0]
+        return (len(self.completions) - 1) / elapsed if elapsed > 0 else 0.0
+    
+    def render(self) -> str:
+        speed = self.speed()
+        remaining = max(0, self.total - self.done)
+        eta = round(remaining / speed) if speed > 0 else "?"
+        return self.header + "\n\n" + config_manager.get_translation(
+            self.user_id, "job_progress", done=self.done, total=self.total, success=self.success,
+            errors=self.errors, skipped=self.skipped, speed=round(speed, 2), eta=eta
+        )
+    
+    async def refresh(self):
+        text = self.render()
+        if text == self.rendered:
+            return
+        try:
+            await outbox.edit(self.message, text)
+            self.rendered = text
+        except TelegramError as e:
+            # Пропущенное обновление не критично: следующее придет через интервал
+            logger.warning(f"Не удалось обновить прогресс: {e}")
+    
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.edit_interval)
+            await self.refresh()
+    
+    def start(self):
+        self.task = asyncio.create_task(self._loop())
+    
+    async def finish(self):
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+        await self.refresh()
+    
+    @classmethod
+    async def create(cls, send, user_id: str, header: str, total: int) -> "ProgressReporter":
+        """Отправка стартового сообщения через send(text) и запуск обновлений"""
+        edit_interval = config_manager.config.get("progress", {}).get("edit_interval", 2.0)
+        reporter = cls(None, user_id, header, total, edit_interval)
+        reporter.rendered = reporter.render()
+        reporter.message = await send(reporter.rendered)
+        reporter.start()
+        return reporter
+
+
+class ReportFile:
+    """Отчет задания, который пишется во временный файл по мере готовности результатов.
+    
+    С columns получается CSV, без них — текстовый файл по строке на запись.
+    После send файл удаляется, так что длинные списки не копятся в памяти
+    и уходят в чат одним документом.
+    """
+    
+    def __init__(self, name: str, columns: tuple = None):
+        suffix = ".csv" if columns else ".txt"
+        fd, self.path = tempfile.mkstemp(prefix="report_", suffix=suffix)
+        self.filename = name + suffix
+        self.file = os.fdopen(fd, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file) if columns else None
+        if self.writer is not None:
+            self.writer.writerow(columns)
+        self.rows = 0
+    
+    @staticmethod
+    def enabled(count: int) -> bool:
+        """Нужен ли файл вместо сообщений для отчета из count строк"""
+        return count > config_manager.config.get("reports", {}).get("file_threshold", 100)
+    
+    def add(self, row):
+        if self.writer is not None:
+            self.writer.writerow(row)
+        else:
+            self.file.write(f"{row}\n")
+        self.rows += 1
+    
+    def discard(self):
+        self.file.close()
+        with contextlib.suppress(OSError):
+            os.remove(self.path)
+    
+    async def send(self, chat_id, caption: str):
+        self.file.close()
+        try:
+            await outbox.send_document(chat_id, self.path, self.filename, caption=caption[:1024])
+        finally:
+            self.discard()
+
+
+def issued_link_line(item: dict) -> str:
+    """Строка выдачи: ссылка на подарок и товар на маркете"""
+    login = item.get("login", "")
+    if login and not login.startswith("https://t.me/giftcode/"):
+        login = f"https://t.me/giftcode/{login}"
+    return f"{login} | https://lzt.market/{item.get('item_id')}/"
+
+
+def prune_issued_links(directory: Path, retention_days: float):
+    """Удаление копий выдачи старше retention_days: в них ссылки на подарки открытым текстом"""
+    cutoff = time.time() - retention_days * 86400
+    for path in directory.glob("issued_*.txt"):
+        with contextlib.suppress(OSError):
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                logger.info(f"Удалена устаревшая копия выдачи {path}")
+
+
+def save_issued_links(name: str, header: str, lines) -> Path:
+    """Сохранение выданных ссылок на диск до отправки: товары уже сняты с маркета,
+    и при сбое Telegram ссылки иначе потерялись бы"""
+    settings = config_manager.config.get("reports", {})
+    directory = Path(settings.get("issued_dir", "issued"))
+    directory.mkdir(parents=True, exist_ok=True)
+    prune_issued_links(directory, settings.get("issued_retention_days", 7))
+    path = directory / f"{name}_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.txt"
+    write_file_atomic(path, itertools.chain([header], (f"{line}\n" for line in lines)))
+    logger.info(f"Выданные ссылки сохранены в {path}")
+    return path
+
+
+async def deliver_issued_links(chat_id, path: Path, header: str, lines, as_file: bool) -> bool:
+    """Отправка выданных ссылок файлом или сообщениями; при ошибке пробуется второй способ.
+    
+    lines — функция, возвращающая строки заново для каждой попытки.
+    """
+    for send_file in (as_file, not as_file):
+        try:
+            if send_file:
+                await outbox.send_document(chat_id, path, path.name, caption=header[:1024])
+            else:
+                await outbox.send_lines(chat_id, lines(), header=header)
+            return True
+        except (TelegramError, OSError) as e:
+            logger.error(f"Чат {chat_id}: не удалось отправить выданные ссылки ({e}), копия: {path}")
+    return False
+
+
+UPLOAD_REPORT_COLUMNS = ("index", "status", "link", "url", "error")
+DELETE_REPORT_COLUMNS = ("item_id", "status", "url", "error")
+
+
+def upload_report_row(result: dict) -> tuple:
+    """Строка CSV-отчета загрузки"""
+    index = result.get("index", 0)
+    login = result.get("login", "")
+    if result["success"]:
+        item_id = result["data"].get("item", {}).get("item_id")
+        return index, "uploaded", login, f"https://lzt.market/{item_id}/" if item_id else "", ""
+    status = "skipped" if result.get("skip_error", False) else "failed"
+    return index, status, login, "", result.get("error", "")
+
+
+def upload_result_line(result: dict) -> str:
+    """Строка итогового сообщения загрузки: ссылка на товар или причина ошибки"""
+    if result["success"]:
+        item_id = result["data"].get("item", {}).get("item_id")
+        return f"https://lzt.market/{item_id}/" if item_id else "Загружен (ID не найден)"
+    error_msg = result.get('error', 'Неизвестная ошибка')
+    return f"Аккаунт {result.get('index', 0)} ({result.get('login', '')}) - {error_msg}"
+
+
+def delete_report_row(result: dict) -> tuple:
+    """Строка CSV-отчета удаления"""
+    item_id = result["item_id"]
+    status = "deleted" if result["success"] else "failed"
+    return item_id, status, f"https://lzt.market/{item_id}/", result.get("error", "")
+
+
+def instrumented(state: str, callback):
+    """Обработчик Telegram с замером длительности по состоянию разговора"""
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        started = time.monotonic()
+        outcome = "ok"
+        try:
+            return await callback(update, context)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.monotonic() - started, state=state, handler=callback.__name__,
+                                    outcome=outcome)
+    return wrapper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-клиент Bot API с замером каждого запроса.
+    
+    Через него проходят и прямые reply_text/edit_text обработчиков, и
+    отправки OutboundQueue. getUpdates идет отдельным клиентом и не
+    учитывается: long polling исказил бы распределение.
+    """
+    
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            outcome = "ok" if status == 200 else "retry_after" if status == 429 else "error"
+            return status, payload
+        finally:
+            TELEGRAM_API_LATENCY.observe(time.monotonic() - started, method=api_method, outcome=outcome)
+
+
+def instrument_handlers(handlers: list, state: str) -> list:
+    """Подмена колбэков обработчиков на версии с метриками"""
+    for handler in handlers:
+        handler.callback = instrumented(state, handler.callback)
+    return handlers
+
+
 # Глобальные экземпляры
 config_manager = None
 bot_instance = None
+outbox = None
 
 
 async def language_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -378,7 +2401,7 @@ async def language_selection(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     
     # Проверяем есть ли уже язык у пользователя
-    if str(user_id) in config_manager.user_data.get("users", {}):
+    if config_manager.has_user(str(user_id)):
         return await start(update, context)
     
     # Если это первый запуск, показываем выбор языка
@@ -421,14 +2444,7 @@ async def start_after_language(update: Update, context: ContextTypes.DEFAULT_TYP
     """Начало работы после выбора языка"""
     user_id = update.effective_user.id
     
-    keyboard = [
-        [config_manager.get_translation(str(user_id), "upload_accounts")],
-        [config_manager.get_translation(str(user_id), "check_items")],
-        [config_manager.get_translation(str(user_id), "issue_items")],
-        [config_manager.get_translation(str(user_id), "settings")],
-        [config_manager.get_translation(str(user_id), "cancel")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    reply_markup = config_manager.get_keyboard(str(user_id), "main")
     
     await update.callback_query.message.reply_text(
         config_manager.get_translation(str(user_id), "welcome"),
@@ -442,17 +2458,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
     
     # Проверяем установлен ли язык
-    if str(user_id) not in config_manager.user_data.get("users", {}):
+    if not config_manager.has_user(str(user_id)):
         return await language_selection(update, context)
     
-    keyboard = [
-        [config_manager.get_translation(str(user_id), "upload_accounts")],
-        [config_manager.get_translation(str(user_id), "check_items")],
-        [config_manager.get_translation(str(user_id), "issue_items")],
-        [config_manager.get_translation(str(user_id), "settings")],
-        [config_manager.get_translation(str(user_id), "cancel")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    reply_markup = config_manager.get_keyboard(str(user_id), "main")
     
     await update.message.reply_text(
         config_manager.get_translation(str(user_id), "welcome"),
@@ -466,37 +2475,25 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
     text = update.message.text
     
-    t_upload = config_manager.get_translation(str(user_id), "upload_accounts")
-    t_check = config_manager.get_translation(str(user_id), "check_items")
-    t_issue = config_manager.get_translation(str(user_id), "issue_items")
-    t_settings = config_manager.get_translation(str(user_id), "settings")
-    t_cancel = config_manager.get_translation(str(user_id), "cancel")
+    action = config_manager.get_action(str(user_id), text)
     
-    if text == t_upload:
-        keyboard = [
-            [config_manager.get_translation(str(user_id), "3_months")],
-            [config_manager.get_translation(str(user_id), "6_months")],
-            [config_manager.get_translation(str(user_id), "12_months")],
-            [config_manager.get_translation(str(user_id), "back")]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
+    if action == "upload_accounts":
         await update.message.reply_text(
             config_manager.get_translation(str(user_id), "select_duration"),
-            reply_markup=reply_markup
+            reply_markup=config_manager.get_keyboard(str(user_id), "upload_duration")
         )
         return SELECT_UPLOAD_DURATION
     
-    elif text == t_check:
+    elif action == "check_items":
         return await check_items(update, context)
     
-    elif text == t_issue:
+    elif action == "issue_items":
         return await select_duration(update, context)
     
-    elif text == t_settings:
+    elif action == "settings":
         return await settings_menu(update, context)
     
-    elif text == t_cancel:
+    elif action == "cancel":
         await update.message.reply_text(
             config_manager.get_translation(str(user_id), "goodbye"),
             reply_markup=ReplyKeyboardRemove()
@@ -513,12 +2510,7 @@ async def settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     currency = config_manager.get_currency()
     origin = config_manager.get_origin()
     
-    keyboard = [
-        [config_manager.get_translation(str(user_id), "change_currency")],
-        [config_manager.get_translation(str(user_id), "change_origin")],
-        [config_manager.get_translation(str(user_id), "back")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    reply_markup = config_manager.get_keyboard(str(user_id), "settings")
     
     await update.message.reply_text(
         config_manager.get_translation(str(user_id), "settings_menu", 
@@ -533,11 +2525,10 @@ async def handle_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
     text = update.message.text
     
-    t_currency = config_manager.get_translation(str(user_id), "change_currency")
-    t_origin = config_manager.get_translation(str(user_id), "change_origin")
+    action = config_manager.get_action(str(user_id), text)
     t_back = config_manager.get_translation(str(user_id), "back")
     
-    if text == t_currency:
+    if action == "change_currency":
         currencies = config_manager.config.get("available_currencies", {})
         keyboard = [[curr.upper()] for curr in currencies.keys()]
         keyboard.append([t_back])
@@ -549,7 +2540,7 @@ async def handle_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return CHANGE_CURRENCY
     
-    elif text == t_origin:
+    elif action == "change_origin":
         origins = config_manager.config.get("available_origins", {})
         keyboard = [[value] for value in origins.values()]
         keyboard.append([t_back])
@@ -561,7 +2552,7 @@ async def handle_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return CHANGE_ORIGIN
     
-    elif text == t_back:
+    elif action == "back":
         return await start(update, context)
     
     return SETTINGS_MENU
@@ -591,7 +2582,7 @@ async def change_origin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     user_id = update.effective_user.id
     text = update.message.text
     
-    if text == config_manager.get_translation(str(user_id), "back"):
+    if config_manager.get_action(str(user_id), text) == "back":
         return await settings_menu(update, context)
     
     origins = config_manager.config.get("available_origins", {})
@@ -616,19 +2607,13 @@ async def select_upload_duration(update: Update, context: ContextTypes.DEFAULT_T
     user_id = update.effective_user.id
     text = update.message.text
     
-    if text == config_manager.get_translation(str(user_id), "back"):
+    action = config_manager.get_action(str(user_id), text)
+    if action == "back":
         return await start(update, context)
     
-    duration_days = None
+    duration_days = DURATION_ACTIONS.get(action)
     duration_text = text
     
-    if text == config_manager.get_translation(str(user_id), "3_months"):
-        duration_days = 90
-    elif text == config_manager.get_translation(str(user_id), "6_months"):
-        duration_days = 180
-    elif text == config_manager.get_translation(str(user_id), "12_months"):
-        duration_days = 360
-    
     if not duration_days:
         await update.message.reply_text(
             config_manager.get_translation(str(user_id), "invalid_duration")
@@ -659,6 +2644,7 @@ async def upload_links(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
         return UPLOAD_LINKS
     
+    await discard_links_draft(context)
     context.user_data["links"] = links
     
     await update.message.reply_text(
@@ -667,6 +2653,60 @@ async def upload_links(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     return UPLOAD_PRICE
 
 
+async def discard_links_draft(context: ContextTypes.DEFAULT_TYPE):
+    """Удаление черновика задания со ссылками из прошлого файла"""
+    job_id = context.user_data.pop("links_job_id", None)
+    if job_id is not None:
+        await asyncio.get_running_loop().run_in_executor(None, bot_instance.jobs.discard_draft, job_id)
+
+
+async def upload_links_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Получение ссылок из файла .txt/.csv без чтения его в память целиком"""
+    global bot_instance
+    user_id = update.effective_user.id
+    document = update.message.document
+    
+    if document.file_size and document.file_size > MAX_DOCUMENT_SIZE:
+        await update.message.reply_text(
+            config_manager.get_translation(str(user_id), "file_too_large",
+                                          size=round(document.file_size / 1024 / 1024, 1),
+                                          limit=MAX_DOCUMENT_SIZE // 1024 // 1024)
+        )
+        return UPLOAD_LINKS
+    
+    await discard_links_draft(context)
+    context.user_data.pop("links", None)
+    
+    fd, links_file = tempfile.mkstemp(prefix="links_", suffix=".txt")
+    os.close(fd)
+    
+    # Разбор и запись в очередь заданий идут одним проходом вне event loop
+    try:
+        tg_file = await document.get_file()
+        await tg_file.download_to_drive(links_file)
+        job_id, count = await asyncio.get_running_loop().run_in_executor(
+            None, bot_instance.jobs.stage_links_file, str(user_id), update.effective_chat.id, links_file
+        )
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(links_file)
+    
+    if not count:
+        await update.message.reply_text(
+            config_manager.get_translation(str(user_id), "links_not_found")
+        )
+        return UPLOAD_LINKS
+    
+    context.user_data["links_job_id"] = job_id
+    context.user_data["links_count"] = count
+    logger.info(f"Пользователь {user_id}: файл {document.file_name}, ссылок: {count}")
+    
+    await update.message.reply_text(
+        config_manager.get_translation(str(user_id), "links_found", count=count)
+    )
+    return UPLOAD_PRICE
+
+
 async def upload_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Получение цены и загрузка аккаунтов"""
     global bot_instance
@@ -680,90 +2720,83 @@ async def upload_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
         return UPLOAD_PRICE
     
-    links = context.user_data.get("links", [])
     duration_days = context.user_data.get("upload_duration", 90)
     duration_text = context.user_data.get("upload_duration_text", "3 months")
     
     context.user_data["upload_price"] = price
     
-    await update.message.reply_text(
+    # Ссылки из файла уже лежат в черновике задания, остается указать цену
+    job_id = context.user_data.pop("links_job_id", None)
+    if job_id is not None:
+        links_count = context.user_data.get("links_count", 0)
+        if not bot_instance.jobs.activate_draft(job_id, price, duration_days, duration_text):
+            await update.message.reply_text(
+                config_manager.get_translation(str(user_id), "links_not_found")
+            )
+            return UPLOAD_LINKS
+    else:
+        links = context.user_data.get("links", [])
+        links_count = len(links)
+        job_id = bot_instance.jobs.create_job(str(user_id), update.effective_chat.id, price,
+                                              duration_days, duration_text, links)
+    context.user_data["upload_job_id"] = job_id
+    
+    chat_id = update.effective_chat.id
+    progress = await ProgressReporter.create(
+        lambda text: outbox.send(chat_id, text), str(user_id),
         config_manager.get_translation(str(user_id), "upload_started", 
-                                      count=len(links), price=price, duration=duration_text)
+                                      count=links_count, price=price, duration=duration_text),
+        links_count
     )
+    report = ReportFile(f"upload_{job_id}", UPLOAD_REPORT_COLUMNS) if ReportFile.enabled(links_count) else None
+    # Результаты не копятся: счетчики ведет ProgressReporter, строки для чата нужны только без файла отчета
+    uploaded_urls = []
+    failed_lines = []
+    
+    def on_result(position, result):
+        progress.on_result(position, result)
+        failed = not result["success"] and not result.get("skip_error", False)
+        if failed and result.get('detailed_error'):
+            logger.error(f"Детальная ошибка аккаунта {result.get('index', 0)}: {result['detailed_error']}")
+        if report is not None:
+            report.add(upload_report_row(result))
+        elif result["success"]:
+            uploaded_urls.append(upload_result_line(result))
+        elif failed:
+            failed_lines.append(upload_result_line(result))
     
-    import time
     start_time = time.time()
     
-    results = await bot_instance.upload_accounts_batch(links, price, duration_days, batch_size=5)
+    try:
+        await bot_instance.run_upload_job(job_id, concurrency=5, on_result=on_result, collect=False)
+    except BaseException:
+        if report is not None:
+            report.discard()
+        raise
+    finally:
+        await progress.finish()
     
     end_time = time.time()
     elapsed_time = round(end_time - start_time, 2)
     
-    uploaded_urls = []
-    failed_uploads = []
-    skipped_count = 0
-    
-    for result in results:
-        idx = result.get("index", 0)
-        login = result.get("login", "")
-        
-        if result["success"]:
-            item_id = result["data"].get("item", {}).get("item_id")
-            if item_id:
-                uploaded_urls.append(f"https://lzt.market/{item_id}/")
-            else:
-                uploaded_urls.append("Загружен (ID не найден)")
-        else:
-            if result.get("skip_error", False):
-                skipped_count += 1
-                continue
-            
-            error_msg = result.get('error', 'Неизвестная ошибка')
-            failed_uploads.append({
-                "index": idx,
-                "login": login,
-                "error": error_msg
-            })
-            
-            detailed = result.get('detailed_error', '')
-            if detailed:
-                logger.error(f"Детальная ошибка аккаунта {idx}: {detailed}")
-    
-    context.user_data["failed_uploads"] = failed_uploads
-    
-    speed = round(len(links)/elapsed_time, 2) if elapsed_time > 0 else 0
+    speed = round(links_count/elapsed_time, 2) if elapsed_time > 0 else 0
     summary = config_manager.get_translation(str(user_id), "upload_completed",
-                                            time=elapsed_time, success=len(uploaded_urls),
-                                            errors=len(failed_uploads), skipped=skipped_count,
+                                            time=elapsed_time, success=progress.success,
+                                            errors=progress.errors, skipped=progress.skipped,
                                             speed=speed)
     
-    if uploaded_urls:
+    if report is not None:
+        await report.send(chat_id, summary)
+    elif uploaded_urls:
         message = summary + config_manager.get_translation(str(user_id), "accounts_uploaded", count=len(uploaded_urls))
-        
-        chunk_size = 50
-        for i in range(0, len(uploaded_urls), chunk_size):
-            chunk = uploaded_urls[i:i + chunk_size]
-            if i == 0:
-                await update.message.reply_text(message + "\n".join(chunk))
-            else:
-                await update.message.reply_text("\n".join(chunk))
+        await outbox.send_lines(chat_id, uploaded_urls, header=message)
     else:
-        await update.message.reply_text(summary + config_manager.get_translation(str(user_id), "no_accounts_uploaded"))
+        await outbox.send(chat_id, summary + config_manager.get_translation(str(user_id), "no_accounts_uploaded"))
     
-    if failed_uploads:
-        error_message = config_manager.get_translation(str(user_id), "failed_to_upload")
-        
-        formatted_errors = []
-        for fail in failed_uploads:
-            formatted_errors.append(f"Аккаунт {fail['index']} ({fail['login']}) - {fail['error']}")
-        
-        chunk_size = 20
-        for i in range(0, len(formatted_errors), chunk_size):
-            chunk = formatted_errors[i:i + chunk_size]
-            if i == 0:
-                await update.message.reply_text(error_message + "\n\n".join(chunk))
-            else:
-                await update.message.reply_text("\n\n".join(chunk))
+    if progress.errors:
+        if report is None:
+            error_message = config_manager.get_translation(str(user_id), "failed_to_upload")
+            await outbox.send_lines(chat_id, failed_lines, header=error_message, separator="\n\n")
         
         keyboard = [
             [InlineKeyboardButton(config_manager.get_translation(str(user_id), "retry_upload"), 
@@ -805,14 +2838,7 @@ async def start_from_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     """Начало работы из callback"""
     user_id = update.effective_user.id
     
-    keyboard = [
-        [config_manager.get_translation(str(user_id), "upload_accounts")],
-        [config_manager.get_translation(str(user_id), "check_items")],
-        [config_manager.get_translation(str(user_id), "issue_items")],
-        [config_manager.get_translation(str(user_id), "settings")],
-        [config_manager.get_translation(str(user_id), "cancel")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    reply_markup = config_manager.get_keyboard(str(user_id), "main")
     
     await update.callback_query.message.reply_text(
         config_manager.get_translation(str(user_id), "select_action"),
@@ -827,90 +2853,73 @@ async def retry_upload_callback(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = update.effective_user.id
     query = update.callback_query
     
-    failed_uploads = context.user_data.get("failed_uploads", [])
+    job_id = context.user_data.get("upload_job_id")
     
-    if not failed_uploads:
+    # Кандидаты на повтор — неудачные ссылки задания в UploadJobStore
+    if job_id is None or not bot_instance.jobs.count_failed(job_id):
         await query.message.reply_text(
             config_manager.get_translation(str(user_id), "no_retry_uploads")
         )
         return await start_from_callback(update, context)
     
-    retry_links = [fail["login"] for fail in failed_uploads]
     price = context.user_data.get("upload_price", 0)
-    duration_days = context.user_data.get("upload_duration", 90)
     duration_text = context.user_data.get("upload_duration_text", "3 months")
     
-    await query.message.reply_text(
+    # Повтор касается только ссылок задания, которые действительно не загрузились
+    retry_count = bot_instance.jobs.requeue_failed(job_id)
+    
+    chat_id = query.message.chat_id
+    remaining = bot_instance.jobs.count_unfinished(job_id)
+    progress = await ProgressReporter.create(
+        lambda text: outbox.send(chat_id, text), str(user_id),
         config_manager.get_translation(str(user_id), "retry_upload_started",
-                                      count=len(retry_links), price=price, duration=duration_text)
+                                      count=retry_count, price=price, duration=duration_text),
+        remaining
     )
+    report = ReportFile(f"retry_{job_id}", UPLOAD_REPORT_COLUMNS) if ReportFile.enabled(remaining) else None
+    uploaded_urls = []
+    failed_lines = []
+    
+    def on_result(position, result):
+        progress.on_result(position, result)
+        if report is not None:
+            report.add(upload_report_row(result))
+        elif result["success"]:
+            uploaded_urls.append(upload_result_line(result))
+        elif not result.get("skip_error", False):
+            failed_lines.append(upload_result_line(result))
     
-    import time
     start_time = time.time()
     
-    results = await bot_instance.upload_accounts_batch(retry_links, price, duration_days, batch_size=5)
+    try:
+        await bot_instance.run_upload_job(job_id, concurrency=5, on_result=on_result, collect=False)
+    except BaseException:
+        if report is not None:
+            report.discard()
+        raise
+    finally:
+        await progress.finish()
     
     end_time = time.time()
     elapsed_time = round(end_time - start_time, 2)
     
-    uploaded_urls = []
-    new_failed_uploads = []
-    skipped_count = 0
-    
-    for result in results:
-        idx = result.get("index", 0)
-        login = result.get("login", "")
-        
-        if result["success"]:
-            item_id = result["data"].get("item", {}).get("item_id")
-            if item_id:
-                uploaded_urls.append(f"https://lzt.market/{item_id}/")
-            else:
-                uploaded_urls.append("Загружен (ID не найден)")
-        else:
-            if result.get("skip_error", False):
-                skipped_count += 1
-                continue
-            
-            error_msg = result.get('error', 'Неизвестная ошибка')
-            new_failed_uploads.append({
-                "index": idx,
-                "login": login,
-                "error": error_msg
-            })
-    
-    context.user_data["failed_uploads"] = new_failed_uploads
-    
     summary = config_manager.get_translation(str(user_id), "retry_completed",
-                                            time=elapsed_time, success=len(uploaded_urls),
-                                            errors=len(new_failed_uploads), skipped=skipped_count)
+                                            time=elapsed_time, success=progress.success,
+                                            errors=progress.errors, skipped=progress.skipped)
     
-    await query.message.reply_text(summary)
+    if report is not None:
+        await report.send(chat_id, summary)
+    else:
+        await outbox.send(chat_id, summary)
     
     if uploaded_urls:
         message = config_manager.get_translation(str(user_id), "uploaded_count", count=len(uploaded_urls))
-        chunk_size = 50
-        for i in range(0, len(uploaded_urls), chunk_size):
-            chunk = uploaded_urls[i:i + chunk_size]
-            if i == 0:
-                await query.message.reply_text(message + "\n".join(chunk))
-            else:
-                await query.message.reply_text("\n".join(chunk))
+        await outbox.send_lines(chat_id, uploaded_urls, header=message)
     
-    if new_failed_uploads:
-        error_message = config_manager.get_translation(str(user_id), "still_failed")
-        
-        formatted_errors = []
-        for fail in new_failed_uploads:
-            formatted_errors.append(f"Аккаунт {fail['index']} ({fail['login']}) - {fail['error']}")
-        
-        chunk_size = 20
-        for i in range(0, len(formatted_errors), chunk_size):
-            chunk = formatted_errors[i:i + chunk_size]
-            if i == 0:
-                await query.message.reply_text(error_message + "\n\n".join(chunk))
-            else:
-                await query.message.reply_text("\n\n".join(chunk))
+    if progress.errors:
+        if report is None:
+            error_message = config_manager.get_translation(str(user_id), "still_failed")
+            await outbox.send_lines(chat_id, failed_lines, header=error_message, separator="\n\n")
         
         keyboard = [
             [InlineKeyboardButton(config_manager.get_translation(str(user_id), "retry_upload"), 
@@ -938,7 +2947,7 @@ async def check_items(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         config_manager.get_translation(str(user_id), "checking_items")
     )
     
-    result = bot_instance.get_user_items()
+    result = await bot_instance.get_inventory()
     
     if not result["success"]:
         await update.message.reply_text(
@@ -970,7 +2979,7 @@ async def select_duration(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     global bot_instance
     user_id = update.effective_user.id
     
-    result = bot_instance.get_user_items()
+    result = await bot_instance.get_inventory()
     
     if not result["success"]:
         await update.message.reply_text(
@@ -978,7 +2987,9 @@ async def select_duration(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return MAIN_MENU
     
-    items = result["data"].get("items", [])
+    # Товары, которые сейчас выдают другие операторы, недоступны
+    leased = bot_instance.leases.leased_ids()
+    items = [item for item in result["data"].get("items", []) if item.get("item_id") not in leased]
     duration_counts = {90: 0, 180: 0, 360: 0}
     
     for item in items:
@@ -1009,18 +3020,11 @@ async def select_count(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     user_id = update.effective_user.id
     text = update.message.text
     
-    if text == config_manager.get_translation(str(user_id), "back"):
+    if config_manager.get_action(str(user_id), text) == "back":
         return await start(update, context)
     
     duration_text = text.split("(")[0].strip()
-    duration_days = None
-    
-    if duration_text == config_manager.get_translation(str(user_id), "3_months"):
-        duration_days = 90
-    elif duration_text == config_manager.get_translation(str(user_id), "6_months"):
-        duration_days = 180
-    elif duration_text == config_manager.get_translation(str(user_id), "12_months"):
-        duration_days = 360
+    duration_days = DURATION_ACTIONS.get(config_manager.get_action(str(user_id), duration_text))
     
     if not duration_days:
         await update.message.reply_text(
@@ -1053,6 +3057,9 @@ async def issue_items(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     try:
         requested_count = int(text)
     except ValueError:
+        requested_count = 0
+    
+    if requested_count <= 0:
         await update.message.reply_text(
             config_manager.get_translation(str(user_id), "enter_number")
         )
@@ -1069,86 +3076,196 @@ async def issue_items(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         )
         return SELECT_COUNT
     
-    await update.message.reply_text(
-        config_manager.get_translation(str(user_id), "issuing_items", count=requested_count)
-    )
+    issue_started = time.time()
     
-    items = context.user_data["items"]
-    filtered_items = [item for item in items if item.get("gifts_duration") == duration_days]
-    items_to_issue = filtered_items[:requested_count]
+    # Кандидаты берутся из общего снимка, а аренда исключает товары, уже взятые другими выдачами
+    result = await bot_instance.get_inventory()
+    if not result["success"]:
+        await update.message.reply_text(
+            config_manager.get_translation(str(user_id), "error_getting_items", error=result['error'])
+        )
+        return MAIN_MENU
     
-    issued_message = f"📋 Months: {duration_text.split()[0]} | Count: {requested_count}\n\n"
-    items_to_delete = []
+    candidates = [item for item in result["data"]["items"] if item.get("gifts_duration") == duration_days]
+    lease_id = bot_instance.leases.new_lease_id(str(user_id))
+    items_to_issue = bot_instance.leases.acquire(lease_id, candidates, requested_count)
     
-    for item in items_to_issue:
-        item_id = item.get("item_id")
-        login = item.get("login", "")
-        
-        if login and not login.startswith("https://t.me/giftcode/"):
-            login = f"https://t.me/giftcode/{login}"
-        
-        issued_message += f"{login} | https://lzt.market/{item_id}/\n"
-        items_to_delete.append(item_id)
+    if len(items_to_issue) < requested_count:
+        bot_instance.leases.release(lease_id)
+        await update.message.reply_text(
+            config_manager.get_translation(str(user_id), "requested_more",
+                                          requested=requested_count, available=len(items_to_issue))
+        )
+        return SELECT_COUNT
     
-    if len(issued_message) > 4000:
-        parts = [issued_message[i:i+4000] for i in range(0, len(issued_message), 4000)]
-        for part in parts:
-            await update.message.reply_text(part)
-    else:
-        await update.message.reply_text(issued_message)
+    chat_id = update.effective_chat.id
+    use_files = ReportFile.enabled(len(items_to_issue))
+    items_to_delete = [item.get("item_id") for item in items_to_issue]
+    deleted_ids = set()
+    gone_ids = set()
+    deleted_urls = []
+    failed_deletes = []
+    report = None
     
-    await update.message.reply_text("⚡ Начинаю турбо-удаление выданных товаров с автоповтором...")
+    def issued_lines():
+        # Строки строятся заново при каждой записи или отправке, отдельный список не держится
+        return (issued_link_line(item) for item in items_to_issue if item.get("item_id") in deleted_ids)
     
-    import time
-    start_time = time.time()
+    # Пока идет удаление (в том числе ожидание открытого breaker), аренда продлевается
+    keep_lease = asyncio.create_task(bot_instance.leases.keep_alive(lease_id))
     
-    results = await bot_instance.delete_items_batch(items_to_delete, batch_size=3)
+    # С момента аренды любой сбой должен вернуть товары в пул, иначе они заняты до истечения ttl
+    try:
+        await update.message.reply_text(
+            config_manager.get_translation(str(user_id), "issuing_items", count=requested_count)
+        )
+        
+        progress = await ProgressReporter.create(lambda text: outbox.send(chat_id, text), str(user_id),
+                                                 "⚡ Начинаю турбо-удаление выданных товаров с автоповтором...",
+                                                 len(items_to_delete))
+        report = ReportFile(f"deleted_{duration_days}d", DELETE_REPORT_COLUMNS) if use_files else None
+        
+        def on_result(position, result):
+            progress.on_result(position, result)
+            if result["success"]:
+                deleted_ids.add(result["item_id"])
+            elif result.get("gone"):
+                gone_ids.add(result["item_id"])
+            if not result["success"] and result.get('detailed_error'):
+                logger.error(f"Детальная ошибка удаления {result['item_id']}: {result['detailed_error']}")
+            if report is not None:
+                report.add(delete_report_row(result))
+            elif result["success"]:
+                deleted_urls.append(f"https://lzt.market/{result['item_id']}/")
+            else:
+                failed_deletes.append(f"https://lzt.market/{result['item_id']}/ | {result.get('error', 'Неизвестная ошибка')}")
+        
+        start_time = time.time()
+        
+        try:
+            await bot_instance.delete_items_batch(items_to_delete, on_result=on_result, collect=False)
+        finally:
+            await progress.finish()
+    except BaseException:
+        keep_lease.cancel()
+        if deleted_ids:
+            # Часть товаров уже снята с маркета: их ссылки не должны пропасть вместе с выдачей
+            save_issued_links(f"issued_{duration_days}d_interrupted", "", issued_lines())
+        bot_instance.leases.release(lease_id, [item_id for item_id in items_to_delete
+                                               if item_id not in deleted_ids and item_id not in gone_ids])
+        if report is not None:
+            report.discard()
+        raise
+    keep_lease.cancel()
     
     end_time = time.time()
     elapsed_time = round(end_time - start_time, 2)
     
-    deleted_urls = []
-    failed_deletes = []
+    # Неудаленные товары возвращаются в общий пул; удаленные и уже исчезнувшие с маркета (404)
+    # остаются в аренде до ее истечения, чтобы устаревший снимок другой выдачи не взял их повторно
+    bot_instance.leases.release(lease_id, [item_id for item_id in items_to_delete
+                                           if item_id not in deleted_ids and item_id not in gone_ids])
     
-    for result in results:
-        if result["success"]:
-            deleted_urls.append(f"https://lzt.market/{result['item_id']}/")
-        else:
-            error_msg = result.get('error', 'Неизвестная ошибка')
-            failed_deletes.append(f"https://lzt.market/{result['item_id']}/ | {error_msg}")
-            
-            detailed = result.get('detailed_error', '')
-            if detailed:
-                logger.error(f"Детальная ошибка удаления {result['item_id']}: {detailed}")
+    # Выдаются только товары, которые удалось снять с продажи: их больше никто не купит и не выдаст
+    issued_header = f"📋 Months: {duration_text.split()[0]} | Count: {len(deleted_ids)}\n\n"
+    issued_path = None
+    delivered = True
+    
+    if deleted_ids:
+        issued_path = save_issued_links(f"issued_{duration_days}d", issued_header, issued_lines())
+        delivered = await deliver_issued_links(chat_id, issued_path, issued_header, issued_lines, use_files)
+    issued_time = round(time.time() - issue_started, 2)
     
     summary = f"⚡ Удаление завершено за {elapsed_time} сек!\n"
-    summary += f"✅ Удалено: {len(deleted_urls)}\n"
-    summary += f"❌ Ошибок: {len(failed_deletes)}\n\n"
-    
-    if deleted_urls:
-        delete_message = summary + "✅ Удалено:\n\n"
-        chunk_size = 50
-        for i in range(0, len(deleted_urls), chunk_size):
-            chunk = deleted_urls[i:i + chunk_size]
-            if i == 0:
-                await update.message.reply_text(delete_message + "\n".join(chunk))
-            else:
-                await update.message.reply_text("\n".join(chunk))
-    else:
-        await update.message.reply_text(summary)
-    
-    if failed_deletes:
-        error_message = "❌ Не удалось удалить:\n\n"
-        chunk_size = 30
-        for i in range(0, len(failed_deletes), chunk_size):
-            chunk = failed_deletes[i:i + chunk_size]
-            if i == 0:
-                await update.message.reply_text(error_message + "\n".join(chunk))
-            else:
-                await update.message.reply_text("\n".join(chunk))
+    summary += f"✅ Удалено: {len(deleted_ids)}\n"
+    summary += f"❌ Ошибок: {progress.errors}\n"
+    summary += f"⏱ Полная выдача заняла {issued_time} сек\n\n"
+    if not delivered:
+        summary += f"⚠️ Ссылки не удалось отправить, копия сохранена на сервере: {issued_path}\n\n"
+    
+    try:
+        if report is not None:
+            await report.send(chat_id, summary)
+        elif deleted_urls:
+            await outbox.send_lines(chat_id, deleted_urls, header=summary + "✅ Удалено:\n\n")
+        else:
+            await outbox.send(chat_id, summary)
+        
+        if failed_deletes:
+            await outbox.send_lines(chat_id, failed_deletes, header="❌ Не удалось удалить:\n\n")
+    except (TelegramError, OSError) as e:
+        # Отчет вторичен: товары уже удалены, а ссылки сохранены, поэтому выдача не прерывается
+        logger.error(f"Чат {chat_id}: не удалось отправить отчет удаления: {e}")
+        with contextlib.suppress(TelegramError, OSError):
+            await outbox.send(chat_id, summary)
     
     return await start(update, context)
 
+async def resume_upload_jobs(application: Application):
+    """Продолжение заданий загрузки, прерванных перезапуском бота"""
+    for job in bot_instance.jobs.unfinished_jobs():
+        job_id = job["job_id"]
+        user_id = job["user_id"]
+        remaining = bot_instance.jobs.count_unfinished(job_id)
+        
+        if not remaining:
+            bot_instance.jobs.finish_job(job_id)
+            continue
+        
+        logger.info(f"Задание {job_id}: возобновление после перезапуска, осталось {remaining}")
+        try:
+            progress = await ProgressReporter.create(
+                lambda text: outbox.send(job["chat_id"], text), user_id,
+                config_manager.get_translation(user_id, "upload_resumed", job_id=job_id, count=remaining,
+                                              price=job["price"], duration=job["duration_text"]),
+                remaining
+            )
+            try:
+                await bot_instance.run_upload_job(job_id, concurrency=5, on_result=progress.on_result, collect=False)
+            finally:
+                await progress.finish()
+            
+            await outbox.send(
+                job["chat_id"],
+                config_manager.get_translation(user_id, "upload_resume_completed", job_id=job_id,
+                                              success=progress.success, errors=progress.errors,
+                                              skipped=progress.skipped)
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Задание {job_id}: ошибка возобновления: {e}")
+
+
+async def on_startup(application: Application):
+    """Открытие ресурсов бота вместе с приложением Telegram"""
+    await bot_instance.start()
+    application.bot_data["resume_task"] = asyncio.create_task(resume_upload_jobs(application))
+    application.bot_data["config_watch_task"] = asyncio.create_task(config_manager.watch())
+    application.bot_data["metrics_runner"] = await metrics.start_server(config_manager.config.get("metrics", {}))
+
+
+async def on_shutdown(application: Application):
+    """Освобождение ресурсов бота при остановке приложения Telegram"""
+    watch_task = application.bot_data.get("config_watch_task")
+    if watch_task is not None:
+        watch_task.cancel()
+    resume_task = application.bot_data.get("resume_task")
+    if resume_task is not None and not resume_task.done():
+        # Незавершенные ссылки остаются в очереди и будут загружены при следующем запуске
+        resume_task.cancel()
+        try:
+            await resume_task
+        except asyncio.CancelledError:
+            pass
+    metrics_runner = application.bot_data.get("metrics_runner")
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await bot_instance.close()
+    bot_instance.jobs.close()
+    await config_manager.flush()
+    config_manager.users.close()
+
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отмена операции"""
@@ -1162,7 +3279,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 def main():
     """Главная функция запуска бота"""
-    global config_manager, bot_instance
+    global config_manager, bot_instance, outbox
     
     # Инициализация менеджера конфигурации
     config_manager = ConfigManager()
@@ -1176,27 +3293,45 @@ def main():
     logger.info("✅ Конфигурация успешно загружена")
     
     # Создание приложения
-    application = Application.builder().token(telegram_token).build()
+    application = (
+        Application.builder()
+        .token(telegram_token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    outbox = OutboundQueue.from_config(application.bot, config_manager.config.get("outbound", {}))
     
     # Настройка обработчика разговора
+    states = {
+        LANGUAGE_SELECT: [CallbackQueryHandler(set_language)],
+        MAIN_MENU: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu),
+            CallbackQueryHandler(handle_callback)
+        ],
+        SELECT_UPLOAD_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_upload_duration)],
+        UPLOAD_LINKS: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, upload_links),
+            MessageHandler(filters.Document.FileExtension("txt") | filters.Document.FileExtension("csv"),
+                           upload_links_document)
+        ],
+        UPLOAD_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, upload_price)],
+        SELECT_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_count)],
+        SELECT_COUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, issue_items)],
+        SETTINGS_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_settings)],
+        CHANGE_CURRENCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, change_currency)],
+        CHANGE_ORIGIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, change_origin)],
+    }
+    
+    # Замер длительности обработчиков по состояниям для /metrics
+    for state, handlers in states.items():
+        instrument_handlers(handlers, STATE_NAMES[state])
+    
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", language_selection)],
-        states={
-            LANGUAGE_SELECT: [CallbackQueryHandler(set_language)],
-            MAIN_MENU: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu),
-                CallbackQueryHandler(handle_callback)
-            ],
-            SELECT_UPLOAD_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_upload_duration)],
-            UPLOAD_LINKS: [MessageHandler(filters.TEXT & ~filters.COMMAND, upload_links)],
-            UPLOAD_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, upload_price)],
-            SELECT_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_count)],
-            SELECT_COUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, issue_items)],
-            SETTINGS_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_settings)],
-            CHANGE_CURRENCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, change_currency)],
-            CHANGE_ORIGIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, change_origin)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        entry_points=instrument_handlers([CommandHandler("start", language_selection)], "entry"),
+        states=states,
+        fallbacks=instrument_handlers([CommandHandler("cancel", cancel)], "fallback"),
     )
     
     application.add_handler(conv_handler)
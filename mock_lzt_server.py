@@ -0,0 +1,138 @@
+"""Локальная замена LZT Market API для замеров без обращения к продакшену.
+
+Поддерживает /item/fast-sell, /user/items и DELETE /{item_id} с
+настраиваемой задержкой, ответами 429 и ошибками "уже продается".
+
+Запуск:
+    python mock_lzt_server.py --port 8080 --latency 0.15 --rate-limit 10
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import re
+import time
+
+from aiohttp import web
+
+
+class MockMarket:
+    """Состояние фейкового маркета: товары продавца и серверный лимит запросов"""
+    
+    def __init__(self, latency: float = 0.1, jitter: float = 0.05, rate_limit: float = 0,
+                 rate_limit_prob: float = 0.0, duplicate_prob: float = 0.0, retry_after: float = 1.0,
+                 per_page: int = 40):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_limit_prob = rate_limit_prob
+        self.duplicate_prob = duplicate_prob
+        self.retry_after = retry_after
+        self.per_page = per_page
+        
+        self.items = {}
+        self.codes = set()
+        self.item_ids = itertools.count(100000)
+        self.tokens = float(rate_limit)
+        self.updated_at = time.monotonic()
+        self.stats = {"requests": 0, "rate_limited": 0, "duplicates": 0}
+    
+    async def delay(self):
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+    
+    def over_limit(self) -> bool:
+        """Серверный token bucket плюс случайные 429"""
+        self.stats["requests"] += 1
+        if self.rate_limit_prob and random.random() < self.rate_limit_prob:
+            return True
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        self.tokens = min(self.rate_limit, self.tokens + (now - self.updated_at) * self.rate_limit)
+        self.updated_at = now
+        if self.tokens < 1:
+            return True
+        self.tokens -= 1
+        return False
+    
+    def too_many_requests(self) -> web.Response:
+        self.stats["rate_limited"] += 1
+        return web.json_response({"errors": ["Too many requests"]}, status=429,
+                                 headers={"Retry-After": str(self.retry_after)})
+    
+    async def fast_sell(self, request: web.Request) -> web.Response:
+        if self.over_limit():
+            return self.too_many_requests()
+        await self.delay()
+        
+        payload = await request.json()
+        match = re.search(r"t\.me/giftcode/([a-zA-Z0-9_-]+)", payload.get("login", ""))
+        code = match.group(1) if match else payload.get("login", "")
+        
+        if code in self.codes or (self.duplicate_prob and random.random() < self.duplicate_prob):
+            self.stats["duplicates"] += 1
+            return web.json_response({"errors": ["Этот аккаунт уже продается на маркете"]}, status=400)
+        
+        item_id = next(self.item_ids)
+        months = re.search(r"(\d+) months", str(payload.get("title_en", "")))
+        duration = int(months.group(1)) * 30 if months else 90
+        self.codes.add(code)
+        self.items[item_id] = {"item_id": item_id, "login": code, "gifts_duration": duration,
+                               "price": payload.get("price"), "title": payload.get("title")}
+        return web.json_response({"status": "ok", "item": {"item_id": item_id}})
+    
+    async def user_items(self, request: web.Request) -> web.Response:
+        if self.over_limit():
+            return self.too_many_requests()
+        await self.delay()
+        
+        page = max(1, int(request.query.get("page", 1)))
+        items = list(self.items.values())
+        start = (page - 1) * self.per_page
+        return web.json_response({
+            "items": items[start:start + self.per_page],
+            "totalItems": len(items),
+            "perPage": self.per_page,
+            "page": page,
+        })
+    
+    async def delete_item(self, request: web.Request) -> web.Response:
+        if self.over_limit():
+            return self.too_many_requests()
+        await self.delay()
+        
+        item_id = int(request.match_info["item_id"])
+        item = self.items.pop(item_id, None)
+        if item is None:
+            return web.json_response({"errors": ["Item not found"]}, status=404)
+        self.codes.discard(item["login"])
+        return web.json_response({"status": "ok"})
+    
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/item/fast-sell", self.fast_sell)
+        app.router.add_get("/user/items", self.user_items)
+        app.router.add_delete(r"/{item_id:\d+}", self.delete_item)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный мок LZT Market API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.1, help="средняя задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.05, help="разброс задержки, сек")
+    parser.add_argument("--rate-limit", type=float, default=0, help="запросов в секунду до 429 (0 — без лимита)")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0, help="вероятность случайного 429")
+    parser.add_argument("--duplicate-prob", type=float, default=0.0, help="вероятность ошибки 'уже продается'")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="значение заголовка Retry-After")
+    args = parser.parse_args()
+    
+    market = MockMarket(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                        rate_limit_prob=args.rate_limit_prob, duplicate_prob=args.duplicate_prob,
+                        retry_after=args.retry_after)
+    web.run_app(market.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()